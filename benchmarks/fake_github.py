@@ -0,0 +1,105 @@
+# In-memory stand-in for the parts of the PyGithub API used by pr_rules_check.py, serving a synthetic PR
+import time, base64, hashlib, threading
+from types import SimpleNamespace
+
+class FakeGithubStats():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def record(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def total(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+class FakeComment():
+    def __init__(self, pull, comment_id, body):
+        self.pull = pull
+        self.id = comment_id
+        self.body = body
+        self.user = SimpleNamespace(login="github-actions[bot]", type="Bot")
+
+    def edit(self, body):
+        self.pull.repo.call("comment.edit")
+        self.body = body
+
+    def delete(self):
+        self.pull.repo.call("comment.delete")
+        self.pull.comments.remove(self)
+
+class FakePull():
+    def __init__(self, repo, number, title, body):
+        self.repo = repo
+        self.number = number
+        self.title = title
+        self.body = body
+        self.base = SimpleNamespace(ref="main", sha=hashlib.sha1(b"base").hexdigest())
+        self.head = SimpleNamespace(ref=f"feature-{number}", sha=hashlib.sha1(f"head-{number}".encode()).hexdigest())
+        self.commits = 1
+        self.comments = []
+
+    def get_issue_comments(self):
+        self.repo.call("pull.get_issue_comments")
+        return list(self.comments)
+
+    def get_issue_comment(self, comment_id):
+        self.repo.call("pull.get_issue_comment")
+        for comment in self.comments:
+            if comment.id == comment_id:
+                return comment
+        raise Exception(f"Comment {comment_id} not found")
+
+    def create_issue_comment(self, body):
+        self.repo.call("pull.create_issue_comment")
+        comment = FakeComment(self, len(self.comments) + 1, body)
+        self.comments.append(comment)
+        return comment
+
+class FakeRepo():
+    def __init__(self, files_diff, rules_content, rules_file_path="pr-rules.md", title="", body="", latency=0.0):
+        # latency simulates the round trip of each API call
+        self.files_diff = files_diff
+        self.rules_content = rules_content
+        self.rules_file_path = rules_file_path
+        self.latency = latency
+        self.stats = FakeGithubStats()
+        self.pull = FakePull(self, 1, title, body)
+
+    def call(self, name):
+        self.stats.record(name)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_pull(self, number):
+        self.call("repo.get_pull")
+        return self.pull
+
+    def get_contents(self, file_path, ref=None):
+        self.call("repo.get_contents")
+        if file_path.lstrip('/') != self.rules_file_path:
+            raise Exception(f"404 {file_path} not found")
+        content = self.rules_content.encode('utf-8')
+        return SimpleNamespace(decoded_content=content, content=base64.b64encode(content).decode('ascii'))
+
+    def compare(self, base, head):
+        self.call("repo.compare")
+        files = [SimpleNamespace(filename=filename, patch=patch, previous_filename=None, status="modified")
+                 for filename, patch in self.files_diff]
+        return SimpleNamespace(status="ahead" if base != head else "identical", files=files if base != head else [])
+
+class FakeGithub():
+    # use as pr_rules_check.Github = FakeGithub.factory(repo)
+    def __init__(self, repo, token=None):
+        self.repo = repo
+        self.token = token
+
+    @classmethod
+    def factory(cls, repo):
+        return lambda token=None, *args, **kwargs: cls(repo, token)
+
+    def get_repo(self, full_name):
+        self.repo.call("github.get_repo")
+        return self.repo
@@ -0,0 +1,90 @@
+# Cold start benchmark: time to import the action in a fresh interpreter, and which heavy packages it loads before
+# the first LLM evaluation, ie. 'python -m benchmarks.import_time --repeat 5 --max-seconds 1'
+import os, sys, json, argparse, statistics, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# packages that should only be imported once an LLM evaluation starts
+DEFERRED_PACKAGES = ("crewai", "crewai_tools", "langchain_core", "langchain_openai", "langchain_community", "openai")
+TARGETS = {
+    # what every container run pays before reading the rules file
+    "startup": "import pr_rules_check",
+    # the same, plus what the first LLM evaluation pays for loading crewai and langchain and building its first task
+    "agent_stack": "import pr_rules_check; from crew.experts import get_chat_class; from crew.tasks import Tasks, PRSchema; "
+                   "get_chat_class(); Tasks(PRSchema(title='', body='', files_diff=[]), 'rule').check_complaince(None)",
+}
+MEASURE = """\
+import sys, json, time
+start = time.perf_counter()
+exec({code!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": sorted(name for name in sys.modules if name.split('.')[0] in {packages!r})}}))
+"""
+
+def measure(code):
+    # runs the code in a fresh interpreter, so nothing is imported beforehand
+    script = MEASURE.format(code=code, packages=DEFERRED_PACKAGES)
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(output.stderr.strip().splitlines()[-1] if output.stderr.strip() else f"exit code {output.returncode}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def slowest_imports(code, count=10):
+    # modules with the highest cumulative import time, from python -X importtime
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True)
+    imports = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        imports.append((int(cumulative) / 1_000_000, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+def run(name, code, repeat):
+    result = {"target": name, "runs": []}
+    for _ in range(repeat):
+        try:
+            result["runs"].append(measure(code))
+        except RuntimeError as e:
+            result["error"] = str(e)
+            return result
+    seconds = [item["seconds"] for item in result["runs"]]
+    result["median"] = statistics.median(seconds)
+    result["min"] = min(seconds)
+    result["max"] = max(seconds)
+    result["deferred_loaded"] = sorted({module.split('.')[0] for item in result["runs"] for module in item["modules"]})
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time of pr-rules before and after loading the agent stack")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per target")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list for the startup target")
+    parser.add_argument("--max-seconds", type=float, help="exit with 1 when the startup import takes longer (median)")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = [run(name, code, args.repeat) for name, code in TARGETS.items()]
+    header = f"{'target':<14}{'median':>9}{'min':>9}{'max':>9}  heavy packages loaded"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        if "error" in result:
+            print(f"{result['target']:<14}  failed: {result['error']}")
+            continue
+        print(f"{result['target']:<14}{result['median']:>9.3f}{result['min']:>9.3f}{result['max']:>9.3f}  {', '.join(result['deferred_loaded']) or '-'}")
+
+    print(f"\nSlowest imports of '{TARGETS['startup']}' (cumulative seconds):")
+    for seconds, name in slowest_imports(TARGETS["startup"], args.top):
+        print(f"{seconds:>9.3f}  {name}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+    # a failing target means the action can't start, or can't build its crews
+    if any("error" in result for result in results):
+        sys.exit(1)
+    startup = results[0]
+    if args.max_seconds is not None and ("error" in startup or startup["median"] > args.max_seconds):
+        print(f"\nStartup import over {args.max_seconds}s")
+        sys.exit(1)
@@ -0,0 +1,195 @@
+# Offline end-to-end benchmarks: runs pr_rules_check.main() and validate_rule over synthetic PRs against a local
+# OpenAI-compatible stub and a fake GitHub API, ie. 'python -m benchmarks.run --files 1,100,500 --rules 1,10,50'
+import os, sys, json, math, time, argparse, resource, tempfile, subprocess, tracemalloc, contextlib, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.synthetic import make_pr
+from benchmarks.fake_github import FakeRepo, FakeGithub
+
+def percentile(values, percent):
+    # nearest-rank percentile, None without values
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+def start_stub(args):
+    # the stub runs in its own process, so it doesn't compete for the GIL nor count in the measured memory
+    command = [sys.executable, "-m", "benchmarks.stub_llm", "--port", "0",
+               "--latency", str(args.latency), "--jitter", str(args.jitter), "--per-token-latency", str(args.per_token_latency),
+               "--relevant-rate", str(args.relevant_rate), "--pass-rate", str(args.pass_rate), "--seed", str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    line = process.stdout.readline().strip()
+    if not line.startswith("listening on "):
+        process.kill()
+        raise RuntimeError(f"LLM stub failed to start: {line}")
+    return process, line[len("listening on "):]
+
+def stub_request(base_url, path, method="GET"):
+    request = urllib.request.Request(f"{base_url}{path}", data=b"{}" if method == "POST" else None, method=method,
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+def set_environment(base_url, args):
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["OPENAI_API_BASE"] = base_url # langchain
+    os.environ["OPENAI_BASE_URL"] = base_url # openai client, ie. crewai memory embeddings
+    os.environ["OTEL_SDK_DISABLED"] = "true" # crewai telemetry
+    os.environ["LLM_TYPE"] = "openai"
+    os.environ["MAX_WORKERS"] = str(args.max_workers)
+    os.environ.pop("GITHUB_STEP_SUMMARY", None)
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    # the crews print a lot, which would dominate the timings on a terminal
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+@contextlib.contextmanager
+def measure(base_url, result):
+    # fills result with the wall time, peak traced memory and the calls received by the stub
+    stub_request(base_url, "/reset", "POST")
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        result["seconds"] = time.perf_counter() - start
+        result["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+        result["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        stub_stats = stub_request(base_url, "/stats")
+        result["llm_calls"] = stub_stats["chat_calls"]
+        result["embedding_calls"] = stub_stats["embedding_calls"]
+        result["prompt_tokens"] = stub_stats["prompt_tokens"]
+        result["completion_tokens"] = stub_stats["completion_tokens"]
+        result["llm_p50"] = percentile(stub_stats["latencies"], 50)
+
+def run_main(base_url, file_count, rule_count, args):
+    # the whole action: rules file, diff, triage, crews and the PR comment, with GitHub served from memory
+    import pr_rules_check
+    title, body, files_diff, rules_content = make_pr(file_count, rule_count, args.seed)
+    repo = FakeRepo(files_diff, rules_content, title=title, body=body, latency=args.github_latency)
+    pr_rules_check.Github = FakeGithub.factory(repo)
+    result = {"mode": "main", "files": file_count, "rules": rule_count}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        metrics_file = os.path.join(tmp_dir, "metrics.json")
+        os.environ.update({
+            "FILE_PATH": "pr-rules.md",
+            "GITHUB_TOKEN": "benchmark",
+            "GITHUB_REPOSITORY": "benchmark/repo",
+            "GITHUB_REF": "refs/pull/1/merge",
+            "DIFF_SOURCE": "api",
+            "METRICS_FILE": metrics_file,
+            "CACHE_DIR": os.path.join(tmp_dir, "cache") if args.cache else ""
+        })
+        with measure(base_url, result), quiet(not args.verbose):
+            try:
+                pr_rules_check.main()
+            except SystemExit:
+                pass # failing mandatory rules exit with 1
+        metrics = {}
+        if os.path.exists(metrics_file):
+            with open(metrics_file, 'r', encoding='utf-8') as f:
+                metrics = json.load(f)
+    latencies = [rule["stages"]["rule"] for rule in metrics.get("rules", {}).values() if "rule" in rule["stages"]]
+    result["latencies"] = latencies
+    result["evaluated_rules"] = len(latencies)
+    result["github_calls"] = repo.stats.total()
+    result["stages"] = {name: stage["seconds"] for name, stage in metrics.get("stages", {}).items()}
+    return result
+
+def run_validate_rule(base_url, file_count, rule_count, args):
+    # the crew alone: every rule against the whole diff, sharing one session like main() does
+    import pr_rules_check
+    from crew.rule_validation import validate_rule, PRSchema
+    from crew.session import CrewSession
+    title, body, files_diff, rules_content = make_pr(file_count, rule_count, args.seed)
+    rules = [rule.text for rule in pr_rules_check.parse_checklist_items(rules_content)]
+    pr_schema = PRSchema(title=title, body=body, files_diff=files_diff)
+    result = {"mode": "validate_rule", "files": file_count, "rules": rule_count}
+    latencies = []
+
+    def check(rule):
+        start = time.perf_counter()
+        validate_rule(pr_schema, rule, session=session)
+        latencies.append(time.perf_counter() - start)
+
+    with measure(base_url, result), quiet(not args.verbose):
+        session = CrewSession()
+        with ThreadPoolExecutor(max_workers=max(1, args.max_workers)) as executor:
+            list(executor.map(check, rules))
+        session.close()
+    result["latencies"] = latencies
+    result["evaluated_rules"] = len(latencies)
+    result["github_calls"] = 0
+    return result
+
+def summarize(result):
+    result["rules_per_second"] = result["evaluated_rules"] / result["seconds"] if result["seconds"] else 0.0
+    result["llm_calls_per_second"] = result["llm_calls"] / result["seconds"] if result["seconds"] else 0.0
+    for percent in (50, 90, 99):
+        result[f"p{percent}"] = percentile(result["latencies"], percent)
+    return result
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.2f}"
+
+def print_table(results):
+    header = f"{'mode':<14}{'files':>6}{'rules':>6}{'crew':>6}{'seconds':>9}{'rules/s':>9}{'p50':>7}{'p90':>7}{'p99':>7}{'llm':>6}{'gh':>5}{'tokens':>9}{'peak MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(f"{result['mode']:<14}{result['files']:>6}{result['rules']:>6}{result['evaluated_rules']:>6}"
+              f"{result['seconds']:>9.2f}{result['rules_per_second']:>9.2f}"
+              f"{format_seconds(result['p50']):>7}{format_seconds(result['p90']):>7}{format_seconds(result['p99']):>7}"
+              f"{result['llm_calls']:>6}{result['github_calls']:>5}{result['prompt_tokens'] + result['completion_tokens']:>9}"
+              f"{result['peak_memory_mb']:>9.1f}")
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(',') if size.strip()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of pr-rules over synthetic PRs")
+    parser.add_argument("--mode", choices=["main", "validate_rule", "both"], default="both")
+    parser.add_argument("--files", type=parse_sizes, default=[1, 10, 100, 500], help="comma-separated PR sizes, in files")
+    parser.add_argument("--rules", type=parse_sizes, default=[1, 10, 50], help="comma-separated rules file sizes")
+    parser.add_argument("--max-workers", type=int, default=1, help="rules validated concurrently")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per LLM call")
+    parser.add_argument("--jitter", type=float, default=0.2, help="random +/- fraction of the LLM latency")
+    parser.add_argument("--per-token-latency", type=float, default=0.0, help="extra seconds per completion token")
+    parser.add_argument("--github-latency", type=float, default=0.0, help="seconds per GitHub API call")
+    parser.add_argument("--relevant-rate", type=float, default=0.8, help="share of rules the stub finds relevant")
+    parser.add_argument("--pass-rate", type=float, default=1.0, help="share of rules the stub finds complying")
+    parser.add_argument("--cache", action="store_true", help="enable the verdict cache (fresh for each run)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the runs")
+    args = parser.parse_args()
+
+    process, base_url = start_stub(args)
+    print(f"LLM stub listening on {base_url}")
+    results = []
+    try:
+        set_environment(base_url, args)
+        modes = ["main", "validate_rule"] if args.mode == "both" else [args.mode]
+        for mode in modes:
+            for file_count in args.files:
+                for rule_count in args.rules:
+                    runner = run_main if mode == "main" else run_validate_rule
+                    print(f"Running {mode} with {file_count} files and {rule_count} rules...", flush=True)
+                    results.append(summarize(runner(base_url, file_count, rule_count, args)))
+    finally:
+        process.terminate()
+        process.wait()
+
+    print()
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print(f"\nResults written to {args.json}")
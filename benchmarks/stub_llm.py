@@ -0,0 +1,266 @@
+# Local stub of the OpenAI chat-completions API with configurable latency, answering with canned verdicts
+# shaped like the crew's output models; run it standalone with 'python -m benchmarks.stub_llm --port 8765'
+import re, json, time, random, hashlib, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+RULE_LINE_PATTERN = re.compile(r'^\s*(\d+)\. "', re.MULTILINE)
+FILENAME_PATTERN = re.compile(r'\*\*Filename:\*\* (\S+)')
+
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+class StubConfig():
+    def __init__(self, latency=0.2, jitter=0.2, per_token_latency=0.0, relevant_rate=0.8, pass_rate=1.0, seed=0):
+        self.latency = latency # seconds per call
+        self.jitter = jitter # +/- fraction of the latency
+        self.per_token_latency = per_token_latency # extra seconds per completion token
+        self.relevant_rate = relevant_rate
+        self.pass_rate = pass_rate
+        self.seed = seed
+
+class StubStats():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.chat_calls = 0
+        self.embedding_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latencies = []
+
+    def record(self, kind, prompt_tokens, completion_tokens, seconds):
+        with self.lock:
+            if kind == "chat":
+                self.chat_calls += 1
+            else:
+                self.embedding_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.latencies.append(seconds)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "chat_calls": self.chat_calls,
+                "embedding_calls": self.embedding_calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "latencies": list(self.latencies)
+            }
+
+def get_prompt(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        parts.append(content)
+    return "\n".join(parts)
+
+def count_rules(prompt):
+    # the batched tasks number their rules as '1. "rule"', the last list in the prompt is the one asked for
+    count = 0
+    for number in RULE_LINE_PATTERN.findall(prompt):
+        number = int(number)
+        if number == 1 or number == count + 1:
+            count = number
+    return max(count, 1)
+
+def find_previous_answer(prompt, properties, max_attempts=50):
+    # crewai converts an agent's final answer into the output model with another call, echo the JSON we answered before
+    decoder = json.JSONDecoder()
+    end = len(prompt)
+    for _ in range(max_attempts):
+        start = prompt.rfind('{"', 0, end)
+        if start < 0:
+            return None
+        try:
+            value, _ = decoder.raw_decode(prompt, start)
+            if isinstance(value, dict) and set(properties) and set(properties) <= set(value):
+                return value
+        except ValueError:
+            pass
+        end = start
+    return None
+
+class CannedAnswers():
+    # builds answers for the output models of crew/tasks.py, deterministic for a given prompt and seed
+    def __init__(self, config: StubConfig):
+        self.config = config
+
+    def random(self, prompt, salt=""):
+        digest = hashlib.sha256(f"{self.config.seed}:{salt}:{prompt}".encode('utf-8')).digest()
+        return random.Random(int.from_bytes(digest[:8], 'big'))
+
+    def verdict(self, prompt, rng):
+        complies = rng.random() < self.config.pass_rate
+        if complies:
+            return {"complies": True, "score": 95, "affected_sections": None}
+        filenames = FILENAME_PATTERN.findall(prompt)
+        return {
+            "complies": False,
+            "score": 30,
+            "affected_sections": [{
+                "section": "file" if filenames else "description",
+                "file": filenames[0] if filenames else None,
+                "why_is_not_complying": "The change doesn't follow the rule (stub verdict).",
+                "what_should_be_changed": ["Follow the rule, ie. ```python\n# compliant code\n```"]
+            }]
+        }
+
+    def answer(self, prompt, properties=None):
+        # properties are the fields of the expected model when known (function calling), otherwise guessed from the prompt
+        rng = self.random(prompt)
+        if properties:
+            previous_answer = find_previous_answer(prompt, properties)
+            if previous_answer is not None:
+                return previous_answer
+        properties = properties or self.guess_properties(prompt)
+        if "rules" in properties:
+            is_triage = "Relevance" in json.dumps(properties["rules"]) or "### Rules to be Evaluated" in prompt
+            items = []
+            for rule_number in range(1, count_rules(prompt) + 1):
+                if is_triage:
+                    item = {"is_relevant": self.random(prompt, rule_number).random() < self.config.relevant_rate}
+                else:
+                    item = self.verdict(prompt, self.random(prompt, rule_number))
+                items.append({"rule_number": rule_number, **item})
+            return {"rules": items}
+        if "is_relevant" in properties:
+            return {"is_relevant": rng.random() < self.config.relevant_rate}
+        return self.verdict(prompt, rng)
+
+    def guess_properties(self, prompt):
+        if "### Rules to be Evaluated" in prompt or "each of the following rules" in prompt:
+            return {"rules": {}}
+        if "### Question:" in prompt and "relevant" in prompt:
+            return {"is_relevant": {}}
+        return {"complies": {}}
+
+def get_tool_schema(body):
+    # instructor asks for the output model as a function call
+    for tool in body.get("tools") or []:
+        function = tool.get("function") or {}
+        return function.get("name"), (function.get("parameters") or {}).get("properties") or {}
+    for function in body.get("functions") or []:
+        return function.get("name"), (function.get("parameters") or {}).get("properties") or {}
+    return None, None
+
+def build_completion(body, answers: CannedAnswers):
+    prompt = get_prompt(body.get("messages") or [])
+    tool_name, properties = get_tool_schema(body)
+    answer = answers.answer(prompt, properties)
+    message = {"role": "assistant", "content": None}
+    if tool_name:
+        message["tool_calls"] = [{
+            "id": "call_" + hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12],
+            "type": "function",
+            "function": {"name": tool_name, "arguments": json.dumps(answer)}
+        }]
+        finish_reason = "tool_calls"
+        completion = message["tool_calls"][0]["function"]["arguments"]
+    elif (body.get("response_format") or {}).get("type") in ("json_object", "json_schema"):
+        message["content"] = completion = json.dumps(answer)
+        finish_reason = "stop"
+    else:
+        # agents follow the ReAct format, a final answer ends their task
+        message["content"] = completion = f"Thought: I now can give a great answer\nFinal Answer: {json.dumps(answer)}"
+        finish_reason = "stop"
+    prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(completion)
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model") or "stub",
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+    }
+
+def build_embeddings(body, dimensions=1536):
+    inputs = body.get("input")
+    inputs = inputs if isinstance(inputs, list) else [inputs]
+    data = []
+    for index, text in enumerate(inputs):
+        rng = random.Random(hashlib.sha256(json.dumps(text).encode('utf-8')).digest())
+        data.append({"object": "embedding", "index": index, "embedding": [rng.uniform(-1, 1) for _ in range(dimensions)]})
+    tokens = sum(estimate_tokens(json.dumps(text)) for text in inputs)
+    return {"object": "list", "data": data, "model": body.get("model") or "stub", "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+def make_handler(config: StubConfig, stats: StubStats):
+    answers = CannedAnswers(config)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, payload, status=200):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def sleep(self, completion_tokens):
+            jitter = random.uniform(-config.jitter, config.jitter) * config.latency
+            time.sleep(max(0.0, config.latency + jitter + completion_tokens * config.per_token_latency))
+
+        def do_GET(self):
+            if self.path.rstrip('/').endswith('/stats'):
+                return self.send_json(stats.to_dict())
+            if self.path.rstrip('/').endswith('/models'):
+                return self.send_json({"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+            self.send_json({"error": {"message": f"unknown path {self.path}"}}, 404)
+
+        def do_POST(self):
+            start = time.perf_counter()
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path.rstrip('/').endswith('/reset'):
+                stats.reset()
+                return self.send_json({"ok": True})
+            if self.path.rstrip('/').endswith('/chat/completions'):
+                if body.get("stream"):
+                    return self.send_json({"error": {"message": "streaming isn't supported by the stub"}}, 400)
+                completion = build_completion(body, answers)
+                self.sleep(completion["usage"]["completion_tokens"])
+                stats.record("chat", completion["usage"]["prompt_tokens"], completion["usage"]["completion_tokens"], time.perf_counter() - start)
+                return self.send_json(completion)
+            if self.path.rstrip('/').endswith('/embeddings'):
+                embeddings = build_embeddings(body)
+                stats.record("embedding", embeddings["usage"]["prompt_tokens"], 0, time.perf_counter() - start)
+                return self.send_json(embeddings)
+            self.send_json({"error": {"message": f"unknown path {self.path}"}}, 404)
+
+    return Handler
+
+def serve(config: StubConfig, host="127.0.0.1", port=0):
+    # returns the running server, its base URL is f"http://{host}:{server.server_port}/v1"
+    stats = StubStats()
+    server = ThreadingHTTPServer((host, port), make_handler(config, stats))
+    server.daemon_threads = True
+    server.stats = stats
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server for the benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per LLM call")
+    parser.add_argument("--jitter", type=float, default=0.2, help="random +/- fraction of the latency")
+    parser.add_argument("--per-token-latency", type=float, default=0.0, help="extra seconds per completion token")
+    parser.add_argument("--relevant-rate", type=float, default=0.8, help="share of rules answered as relevant")
+    parser.add_argument("--pass-rate", type=float, default=1.0, help="share of rules answered as complying")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    config = StubConfig(args.latency, args.jitter, args.per_token_latency, args.relevant_rate, args.pass_rate, args.seed)
+    server = serve(config, args.host, args.port)
+    print(f"listening on http://{args.host}:{server.server_port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,92 @@
+# Synthetic PRs and rule files of a given size, reproducible from a seed
+import random
+
+PYTHON_LINES = [
+    "def {name}(items):",
+    "    total = 0",
+    "    for item in items:",
+    "        total += item.{field}",
+    "    return total",
+    "result = {name}(load_{field}s())",
+    "logger.info('processed %s {field}s', len(items))",
+    "if not {field}:",
+    "    raise ValueError('missing {field}')",
+    "class {class_name}:",
+    "    def __init__(self, {field}):",
+    "        self.{field} = {field}",
+]
+JS_LINES = [
+    "export function {name}(items) {{",
+    "  return items.map((item) => item.{field});",
+    "}}",
+    "const {field}Count = items.length;",
+    "if (!{field}) {{ throw new Error('missing {field}'); }}",
+    "console.log(`processed ${{{field}Count}} {field}s`);",
+]
+SQL_LINES = [
+    "SELECT id, {field} FROM {table} WHERE {field} IS NOT NULL;",
+    "ALTER TABLE {table} ADD COLUMN {field} TEXT;",
+    "CREATE INDEX idx_{table}_{field} ON {table} ({field});",
+]
+WORDS = ["user", "order", "invoice", "payment", "account", "session", "report", "item", "price", "address"]
+FILE_TYPES = [("py", PYTHON_LINES, 0.6), ("js", JS_LINES, 0.3), ("sql", SQL_LINES, 0.1)]
+
+RULES = [
+    "All code variables must use snake_case convention.",
+    "The PR description cannot be empty.",
+    "The PR description must be in English.",
+    "Method names should always be descriptive.",
+    "The code can't contain literal SQL statements.",
+    "No code diff should be more than 100 lines.",
+    "Every new function must have a docstring or comment explaining its purpose.",
+    "Errors must be logged before being re-raised.",
+    "Database migrations must be reversible.",
+    "Public functions must validate their inputs.",
+    "Secrets and credentials must never be hardcoded.",
+    "New dependencies must be pinned to a version.",
+    "User-facing strings must be translatable.",
+    "Loops over database queries must avoid N+1 queries.",
+    "Log messages must not include personal data.",
+    "Magic numbers must be replaced by named constants.",
+    "Functions should not be longer than 50 lines.",
+    "Exceptions must not be silently swallowed.",
+    "HTTP calls must define a timeout.",
+    "Feature flags must have an owner and a removal date.",
+]
+
+def make_patch(rng, lines, added_count):
+    # a single hunk adding added_count lines around a few context lines
+    words = {"name": f"{rng.choice(WORDS)}_{rng.choice(WORDS)}", "field": rng.choice(WORDS),
+             "table": f"{rng.choice(WORDS)}s", "class_name": rng.choice(WORDS).capitalize() + "Service"}
+    start = rng.randint(1, 200)
+    body = [" " + rng.choice(lines).format(**words) for _ in range(3)]
+    body += ["+" + rng.choice(lines).format(**words) for _ in range(added_count)]
+    body += [" " + rng.choice(lines).format(**words) for _ in range(3)]
+    return f"@@ -{start},6 +{start},{6 + added_count} @@\n" + "\n".join(body)
+
+def make_files_diff(file_count, seed=0, min_lines=5, max_lines=60):
+    # returns (filename, patch) tuples like get_diff
+    rng = random.Random(seed)
+    files_diff = []
+    for index in range(file_count):
+        extension, lines, _ = rng.choices(FILE_TYPES, weights=[weight for _, _, weight in FILE_TYPES])[0]
+        folder = "migrations" if extension == "sql" else f"src/{rng.choice(WORDS)}"
+        files_diff.append((f"{folder}/file_{index}.{extension}", make_patch(rng, lines, rng.randint(min_lines, max_lines))))
+    return files_diff
+
+def make_rules_file(rule_count, seed=0, mandatory_rate=0.6):
+    # returns the markdown of a rules file, cycling through RULES with numbered variants past its length
+    rng = random.Random(seed)
+    lines = []
+    for index in range(rule_count):
+        rule = RULES[index % len(RULES)]
+        if index >= len(RULES):
+            rule = f"{rule[:-1]} (variant {index // len(RULES)})."
+        lines.append(f"- [{'x' if rng.random() < mandatory_rate else ' '}] {rule}")
+    return "\n".join(lines) + "\n"
+
+def make_pr(file_count, rule_count, seed=0):
+    # returns (title, body, files_diff, rules markdown)
+    title = f"Synthetic PR touching {file_count} files"
+    body = f"Refactors the {random.Random(seed).choice(WORDS)} handling across {file_count} files and adds the related migrations."
+    return title, body, make_files_diff(file_count, seed), make_rules_file(rule_count, seed)
@@ -0,0 +1,94 @@
+# Content-addressed on-disk cache of rule verdicts, so re-runs over unchanged PR contents skip the crew
+import os, json, time, hashlib
+from crew.tasks import PRSchema, RulesOutput, RuleValidity
+
+# models that can be stored in the cache, by name
+CACHEABLE_MODELS = {model.__name__: model for model in (RulesOutput, RuleValidity)}
+
+class VerdictCache():
+    # entries live at <directory>/verdicts/<key[:2]>/<key>.json, so the whole directory can be
+    # saved and restored with actions/cache; an entry's mtime is refreshed on every hit
+    def __init__(self, directory, max_size_mb=50, max_age_days=14):
+        self.directory = os.path.join(directory, "verdicts")
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, PR: PRSchema, rule: str, model: str):
+        # hash of everything the crew sees for a rule, plus the model that judges it
+        content = json.dumps({
+            "rule": rule,
+            "title": PR.title,
+            "body": PR.body,
+            "files_diff": sorted([list(file) for file in PR.files_diff]),
+            "model": model
+        }, sort_keys=True)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def has(self, key):
+        # whether get() would return a verdict, without counting it as a hit or refreshing it
+        path = self._path(key)
+        return os.path.exists(path) and time.time() - os.path.getmtime(path) <= self.max_age
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            output = CACHEABLE_MODELS[entry["type"]].model_validate(entry["output"])
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            print(f"Ignoring unreadable cache entry {key}: {e}")
+            self.misses += 1
+            return None
+        if time.time() - os.path.getmtime(path) > self.max_age:
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return output
+
+    def set(self, key, output):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {
+            "type": type(output).__name__,
+            "output": output.model_dump(mode="json")
+        }
+        # write to a temp file first, so concurrent workers never read half-written entries
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def prune(self):
+        # drop entries older than max_age, then the least recently used ones until we fit in max_size
+        entries = []
+        removed = 0
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    os.remove(path)
+                    removed += 1
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            os.remove(path)
+            total_size -= size
+            removed += 1
+        return removed
@@ -0,0 +1,216 @@
+# Deterministic checkers for rules that can be decided from the PR contents without an LLM
+import os, re, ast, importlib.util
+from textwrap import dedent
+from crew.tasks import PRSchema, RulesOutput, Reasoning
+
+# registered checkers as (compiled rule pattern, checker function), in registration order
+CHECKERS = []
+
+PYTHON_EXTENSIONS = ('.py',)
+JAVASCRIPT_EXTENSIONS = ('.js', '.jsx', '.mjs', '.cjs', '.ts', '.tsx')
+NON_CODE_EXTENSIONS = (
+    '.md', '.rst', '.txt', '.json', '.yml', '.yaml', '.toml', '.ini', '.cfg', '.lock', '.csv',
+    '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.pdf'
+)
+NON_CODE_FILENAMES = ('LICENSE', 'Dockerfile', 'Makefile', 'package-lock.json', 'yarn.lock', 'poetry.lock')
+
+HUNK_HEADER_PATTERN = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+
+def register_checker(pattern):
+    # decorator registering fn(PR, rule, match) -> RulesOutput, for rules whose whole text matches the regex pattern;
+    # the checker returns None when it can't decide the rule confidently, so the LLM crew handles it instead
+    def decorator(fn):
+        CHECKERS.append((re.compile(pattern, re.IGNORECASE), fn))
+        return fn
+    return decorator
+
+def load_checkers_file(file_path):
+    # imports a user python file that registers its own checkers through register_checker
+    spec = importlib.util.spec_from_file_location("user_checkers", file_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def normalize_rule(rule):
+    # collapses whitespace and drops the trailing period, so the patterns only need to describe the wording
+    return ' '.join(rule.replace('\u2019', "'").split()).rstrip('.').strip()
+
+def run_local_checkers(PR: PRSchema, rule: str):
+    # returns the verdict of the first registered checker able to decide the rule, or None;
+    # the pattern must match the whole rule, so a checker never settles a rule that asks for something more
+    normalized_rule = normalize_rule(rule)
+    for pattern, checker in CHECKERS:
+        match = pattern.fullmatch(normalized_rule)
+        if not match:
+            continue
+        try:
+            output = checker(PR, rule, match)
+        except Exception as e:
+            print(f"Local checker {checker.__name__} failed for rule '{rule}': {e}")
+            continue
+        if output is not None:
+            print(f"Rule decided by local checker {checker.__name__}: {rule}")
+            return output
+    return None
+
+# helpers for checkers
+def is_code_file(filename):
+    basename = os.path.basename(filename)
+    return basename not in NON_CODE_FILENAMES and not filename.lower().endswith(NON_CODE_EXTENSIONS)
+
+def get_added_lines(patch):
+    # returns (line number in the new file, content) for each line added by the patch
+    added_lines = []
+    line_number = None
+    for line in patch.split('\n'):
+        header = HUNK_HEADER_PATTERN.match(line)
+        if header:
+            line_number = int(header.group(1))
+            continue
+        if line_number is None or line.startswith('\\'):
+            continue # file headers before the first hunk, or '\ No newline at end of file'
+        if line.startswith('+'):
+            added_lines.append((line_number, line[1:]))
+            line_number += 1
+        elif not line.startswith('-'):
+            line_number += 1
+    return added_lines
+
+def count_changed_lines(patch):
+    # number of added and removed lines in the patch
+    changed_lines = 0
+    in_hunk = False
+    for line in patch.split('\n'):
+        if HUNK_HEADER_PATTERN.match(line):
+            in_hunk = True
+        elif in_hunk and line[:1] in ('+', '-'):
+            changed_lines += 1
+    return changed_lines
+
+def complies():
+    return RulesOutput(complies=True, score=100, affected_sections=None)
+
+def not_complies(score, affected_sections):
+    return RulesOutput(complies=False, score=max(0, min(100, score)), affected_sections=affected_sections)
+
+# built-in checkers, their patterns match the whole normalized rule
+NEGATED_MODAL = r"(?:cannot|can't|can not|must not|mustn't|should not|shouldn't|may not|shall not)"
+
+@register_checker(r"(?:the\s+)?(?:(?:PR|pull request)(?:'s)?\s+)?(title|description|body)(?:\s+of\s+(?:the|a)\s+(?:PR|pull request))?\s+"
+                  + NEGATED_MODAL + r"\s+be\s+empty")
+def check_not_empty(PR, rule, match):
+    field_name = match.group(1).lower()
+    value = PR.title if field_name == "title" else PR.body
+    if value and value.strip():
+        return complies()
+    section = "title" if field_name == "title" else "description"
+    return not_complies(0, [Reasoning(
+        section=section,
+        file=None,
+        why_is_not_complying=f"The PR **{section}** is empty.",
+        what_should_be_changed=[f"Add a {section} to the PR summarizing **what** changes and **why**."]
+    )])
+
+@register_checker(r"(?:no\s+(?:single\s+)?(?:code\s+|file\s+)?diffs?\s+(?:should|must|can|may|shall)|"
+                  r"(?:(?:the|a|each|every)\s+)?(?:single\s+)?(?:code\s+|file\s+)?diffs?\s+" + NEGATED_MODAL + r")"
+                  r"\s+(?:be\s+)?(?:more than|longer than|over|exceed)\s+(\d+)\s+(?:changed\s+)?lines(?:\s+long|\s+of code)?")
+def check_diff_size(PR, rule, match):
+    max_lines = int(match.group(1))
+    affected_sections = []
+    for filename, patch in PR.files_diff:
+        if not is_code_file(filename):
+            continue
+        changed_lines = count_changed_lines(patch)
+        if changed_lines > max_lines:
+            affected_sections.append(Reasoning(
+                section="file",
+                file=filename,
+                why_is_not_complying=f"The diff of this file changes **{changed_lines} lines**, above the limit of {max_lines}.",
+                what_should_be_changed=[f"Split the changes to `{filename}` into smaller PRs of at most {max_lines} lines each."]
+            ))
+    if not affected_sections:
+        return complies()
+    return not_complies(100 - 100 * len(affected_sections) // max(1, len(PR.files_diff)), affected_sections)
+
+SNAKE_CASE_PATTERN = re.compile(r'^_*[a-z][a-z0-9]*(?:_[a-z0-9]+)*_*$|^_+$')
+CONSTANT_PATTERN = re.compile(r'^_*[A-Z][A-Z0-9]*(?:_[A-Z0-9]+)*$')
+JAVASCRIPT_DECLARATION_PATTERN = re.compile(r'\b(?:let|const|var)\s+([A-Za-z_$][\w$]*)')
+PYTHON_ASSIGNMENT_PATTERN = re.compile(r'^\s*([A-Za-z_]\w*)\s*(?::[^=]+)?=(?!=)')
+
+def get_python_variable_names(added_lines):
+    # parses the added lines as a whole when possible, otherwise falls back to scanning each line
+    code = dedent('\n'.join(content for _, content in added_lines))
+    try:
+        tree = ast.parse(code)
+        names = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                names.add(node.id)
+            elif isinstance(node, ast.arg) and node.arg not in ('self', 'cls'):
+                names.add(node.arg)
+        return names
+    except SyntaxError:
+        return {match.group(1) for _, content in added_lines if (match := PYTHON_ASSIGNMENT_PATTERN.match(content))}
+
+def get_javascript_variable_names(added_lines):
+    return {name for _, content in added_lines for name in JAVASCRIPT_DECLARATION_PATTERN.findall(content)}
+
+@register_checker(r"(?:all\s+)?(?:(?:code|new|python|javascript)\s+)?variables?(?:\s+names?)?\s+(?:must|should|shall|have to)\s+(?:use|follow|be(?:\s+in)?|be\s+written\s+in)\s+"
+                  r"(?:the\s+)?snake[_ -]?case(?:\s+(?:convention|naming convention|naming|style))?")
+def check_snake_case_variables(PR, rule, match):
+    affected_sections = []
+    scanned_names = 0
+    invalid_count = 0
+    for filename, patch in PR.files_diff:
+        lower_filename = filename.lower()
+        if lower_filename.endswith(PYTHON_EXTENSIONS):
+            names = get_python_variable_names(get_added_lines(patch))
+        elif lower_filename.endswith(JAVASCRIPT_EXTENSIONS):
+            names = get_javascript_variable_names(get_added_lines(patch))
+        else:
+            continue
+        scanned_names += len(names)
+        invalid_names = sorted(name for name in names if not SNAKE_CASE_PATTERN.match(name) and not CONSTANT_PATTERN.match(name))
+        invalid_count += len(invalid_names)
+        if invalid_names:
+            affected_sections.append(Reasoning(
+                section="file",
+                file=filename,
+                why_is_not_complying="These variables are not in snake_case: " + ", ".join(f"`{name}`" for name in invalid_names),
+                what_should_be_changed=[f"Rename them using lowercase words separated by underscores, ie. ```{invalid_names[0]} -> {to_snake_case(invalid_names[0])}```"]
+            ))
+    if affected_sections:
+        return not_complies(100 - 100 * invalid_count // max(1, scanned_names), affected_sections)
+    # we can only vouch for the languages we scan
+    if any(is_code_file(filename) and not filename.lower().endswith(PYTHON_EXTENSIONS + JAVASCRIPT_EXTENSIONS) for filename, _ in PR.files_diff):
+        return None
+    return complies()
+
+def to_snake_case(name):
+    return re.sub(r'(?<=[a-z0-9])(?=[A-Z])', '_', name).lower()
+
+SQL_STRING_PATTERN = re.compile(r'''["'`]\s*(?:SELECT\s+.+?\s+FROM|INSERT\s+INTO|UPDATE\s+\w+\s+SET|DELETE\s+FROM|CREATE\s+TABLE|ALTER\s+TABLE|DROP\s+TABLE)\b''', re.IGNORECASE)
+SQL_STATEMENT_PATTERN = re.compile(r'^\s*(?:SELECT\s+.+?\s+FROM|INSERT\s+INTO|UPDATE\s+\w+\s+SET|DELETE\s+FROM|CREATE\s+TABLE|ALTER\s+TABLE|DROP\s+TABLE)\b')
+
+@register_checker(r"(?:no|(?:the\s+)?(?:code|PR|changes)\s+" + NEGATED_MODAL + r"\s+(?:contain|include|add|use|have)(?:\s+any)?)\s+"
+                  r"(?:literal|raw|hard-?coded|inline)\s+SQL(?:\s+(?:statements?|quer(?:y|ies)|strings?))?")
+def check_literal_sql(PR, rule, match):
+    affected_sections = []
+    for filename, patch in PR.files_diff:
+        if not is_code_file(filename) or filename.lower().endswith('.sql'):
+            continue
+        lines = [line_number for line_number, content in get_added_lines(patch)
+                 if SQL_STRING_PATTERN.search(content) or SQL_STATEMENT_PATTERN.match(content)]
+        if lines:
+            affected_sections.append(Reasoning(
+                section="file",
+                file=filename,
+                why_is_not_complying="Literal SQL statements were added at line(s) " + ", ".join(str(line) for line in lines) + ".",
+                what_should_be_changed=["Use the project's ORM or query builder instead of writing SQL statements in the code."]
+            ))
+    if affected_sections:
+        return not_complies(0, affected_sections)
+    # whether .sql files count as 'code' is a judgement call, leave those to the crew
+    if any(filename.lower().endswith('.sql') for filename, _ in PR.files_diff):
+        return None
+    return complies()
@@ -0,0 +1,124 @@
+# Splits large PR diffs into token-budgeted chunks, and merges the per-chunk verdicts back into one
+import os, re
+from typing import List, Tuple
+from crew.tasks import RulesOutput
+
+HUNK_START_PATTERN = re.compile(r'^@@ ', re.MULTILINE)
+
+def get_max_diff_tokens():
+    # token budget for the diffs sent within a single prompt
+    return int(os.getenv('MAX_DIFF_TOKENS') or 4000)
+
+def get_max_prompt_tokens():
+    # token budget for a whole prompt, ie. when several rules are checked in a single call
+    return int(os.getenv('MAX_PROMPT_TOKENS') or 7000)
+
+def estimate_tokens(text):
+    # rough estimate for english text and code (~4 characters per token), good enough for budgeting
+    return (len(text) + 3) // 4
+
+def estimate_file_tokens(file):
+    # accounts for the filename and markdown wrapping added around each diff in the prompt
+    return estimate_tokens(file[0]) + estimate_tokens(file[1]) + 10
+
+def split_patch(patch, max_tokens):
+    # splits a patch into pieces under max_tokens, on hunk boundaries when possible, otherwise on lines
+    hunk_starts = [match.start() for match in HUNK_START_PATTERN.finditer(patch)]
+    if not hunk_starts or hunk_starts[0] != 0:
+        hunk_starts.insert(0, 0)
+    hunks = [patch[start:end] for start, end in zip(hunk_starts, hunk_starts[1:] + [len(patch)])]
+
+    pieces = []
+    for hunk in hunks:
+        if estimate_tokens(hunk) <= max_tokens:
+            pieces.append(hunk)
+            continue
+        lines = []
+        for line in hunk.split('\n'):
+            if lines and estimate_tokens('\n'.join(lines + [line])) > max_tokens:
+                pieces.append('\n'.join(lines))
+                lines = []
+            lines.append(line)
+        if lines:
+            pieces.append('\n'.join(lines))
+
+    # merge consecutive pieces back together while they fit in the budget
+    merged = []
+    for piece in pieces:
+        if merged and estimate_tokens(merged[-1] + piece) <= max_tokens:
+            merged[-1] += piece
+        else:
+            merged.append(piece)
+    return merged
+
+def chunk_files_diff(files_diff: List[Tuple[str, str]], max_tokens=None) -> List[List[Tuple[str, str]]]:
+    # packs (filename, patch) tuples into chunks under the token budget, keeping the files order
+    max_tokens = max_tokens or get_max_diff_tokens()
+    chunks = []
+    current_chunk = []
+    current_tokens = 0
+    for filename, patch in files_diff:
+        if estimate_file_tokens((filename, patch)) > max_tokens:
+            files = [(filename, piece) for piece in split_patch(patch, max_tokens - estimate_tokens(filename) - 10)]
+        else:
+            files = [(filename, patch)]
+        for file in files:
+            file_tokens = estimate_file_tokens(file)
+            if current_chunk and current_tokens + file_tokens > max_tokens:
+                chunks.append(current_chunk)
+                current_chunk = []
+                current_tokens = 0
+            current_chunk.append(file)
+            current_tokens += file_tokens
+    if current_chunk or not chunks:
+        chunks.append(current_chunk)
+    return chunks
+
+def merge_outputs(outputs: List[RulesOutput], requirement=False) -> RulesOutput:
+    # the PR complies only if every chunk complies, and scores as its worst chunk;
+    # for requirement rules (ie. "must include tests") what's required may be in any chunk, so one complying chunk is enough
+    if requirement:
+        complying = [output for output in outputs if output.complies]
+        if complying:
+            return RulesOutput(complies=True, score=max(output.score for output in complying), affected_sections=None)
+    affected_sections = []
+    seen_sections = set()
+    for output in outputs:
+        for section in output.affected_sections or []:
+            section_key = (section.section, section.file, section.why_is_not_complying)
+            if section_key not in seen_sections:
+                seen_sections.add(section_key)
+                affected_sections.append(section)
+    return RulesOutput(
+        complies=all(output.complies for output in outputs),
+        score=min(output.score for output in outputs),
+        affected_sections=affected_sections or None
+    )
+
+def group_rules(rule_schemas, max_tokens=None, tokens_per_answer=400, max_group_size=10):
+    # groups the rules that see the same files, so each group can be checked in a single prompt; groups are
+    # split so the PR context plus the rules and their answers fit in max_tokens, and PRs too big for it are left out
+    max_tokens = max_tokens or get_max_prompt_tokens()
+    contexts = {}
+    for rule, PR in rule_schemas.items():
+        context_key = tuple(PR.files_diff)
+        contexts.setdefault(context_key, (PR, []))[1].append(rule)
+
+    groups = []
+    for PR, rules in contexts.values():
+        context_tokens = estimate_tokens(f"{PR.title}\n{PR.body}") + sum(estimate_file_tokens(file) for file in PR.files_diff)
+        group = []
+        group_tokens = context_tokens
+        for rule in rules:
+            rule_tokens = estimate_tokens(rule) + tokens_per_answer
+            if group and (group_tokens + rule_tokens > max_tokens or len(group) >= max_group_size):
+                groups.append((PR, group))
+                group = []
+                group_tokens = context_tokens
+            if group_tokens + rule_tokens > max_tokens:
+                break
+            group.append(rule)
+            group_tokens += rule_tokens
+        if group:
+            groups.append((PR, group))
+    return groups
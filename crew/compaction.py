@@ -0,0 +1,175 @@
+# Strips noise from the PR diffs before they're embedded in the prompts
+import os, re
+from collections import Counter
+from crew.chunking import estimate_tokens
+
+HUNK_HEADER_PATTERN = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$')
+
+VENDORED_PATH_PATTERN = re.compile(r'(^|/)(vendor|vendors|third_party|node_modules|bower_components|dist|build|\.yarn)/')
+GENERATED_FILENAME_PATTERN = re.compile(r'(\.min\.(js|css)|\.map|\.pb\.go|_pb2(_grpc)?\.pyi?|\.generated\.\w+|\.g\.dart|\.snap)$')
+LOCKFILE_NAMES = ('package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'poetry.lock', 'Pipfile.lock', 'Cargo.lock', 'composer.lock', 'Gemfile.lock', 'go.sum', 'uv.lock')
+GENERATED_MARKER_PATTERN = re.compile(r'@generated|DO NOT EDIT|Code generated by|auto-?generated', re.IGNORECASE)
+MINIFIED_LINE_LENGTH = 300
+# files where re-indenting a line changes what it does, so their indentation-only hunks are kept
+INDENTATION_SENSITIVE_PATTERN = re.compile(r'(\.(py|pyi|yml|yaml|haml|pug|slim|coffee|nim|sass|styl)|(^|/)Makefile)$', re.IGNORECASE)
+
+def is_new_file(patch):
+    # whether the patch adds the whole file, ie. its first hunk starts at '@@ -0,0'
+    for line in patch.split('\n'):
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match:
+            return match.group(1) == '0' and match.group(2) == '0'
+    return False
+
+def get_omitted_reason(filename, patch):
+    # returns why the file's diff is noise for the rules (lockfile, vendored, generated, minified), or None
+    basename = os.path.basename(filename)
+    if basename in LOCKFILE_NAMES:
+        return "lockfile"
+    if VENDORED_PATH_PATTERN.search(filename):
+        return "vendored file"
+    if GENERATED_FILENAME_PATTERN.search(filename):
+        return "generated file"
+    added_lines = [line[1:] for line in patch.split('\n') if line.startswith('+')]
+    # generators write their marker at the top of the file, elsewhere it's likely just a comment mentioning it
+    if is_new_file(patch) and any(GENERATED_MARKER_PATTERN.search(line) for line in added_lines[:5]):
+        return "generated file"
+    if added_lines and sum(len(line) for line in added_lines) / len(added_lines) > MINIFIED_LINE_LENGTH:
+        return "minified file"
+    return None
+
+def format_hunk_header(old_start, old_count, new_start, new_count, section=""):
+    # git points empty ranges at the line before them, which is line 0 for ranges at the start of the file
+    if old_count == 0 and old_start > 0:
+        old_start -= 1
+    if new_count == 0 and new_start > 0:
+        new_start -= 1
+    return f"@@ -{old_start},{old_count} +{new_start},{new_count} @@{section}"
+
+def normalize_whitespace(line, keep_indentation=False):
+    content = line[1:]
+    indentation = content[:len(content) - len(content.lstrip())] if keep_indentation else ''
+    return indentation + ' '.join(content.split())
+
+def is_whitespace_only(lines, keep_indentation=False):
+    # the hunk only re-indents or re-spaces lines when the removed and added lines match once whitespace is collapsed;
+    # with keep_indentation, changing the indentation of a line isn't whitespace-only
+    removed = Counter(normalize_whitespace(line, keep_indentation) for line in lines if line.startswith('-'))
+    added = Counter(normalize_whitespace(line, keep_indentation) for line in lines if line.startswith('+'))
+    return removed == added
+
+def compact_hunk(header, lines, context_lines):
+    # returns the hunk split around its changes, keeping at most context_lines unchanged lines around each change
+    old_start, _, new_start, _, section = header.groups()
+    old_line, new_line = int(old_start), int(new_start)
+    numbered_lines = []
+    for line in lines:
+        numbered_lines.append((line, old_line, new_line))
+        if line.startswith('-'):
+            old_line += 1
+        elif line.startswith('+'):
+            new_line += 1
+        elif not line.startswith('\\'):
+            old_line += 1
+            new_line += 1
+
+    changes = [index for index, (line, _, _) in enumerate(numbered_lines) if line[:1] in ('+', '-')]
+    if not changes:
+        return []
+    if not any(line.startswith('+') for line, _, _ in numbered_lines):
+        # deletions-only hunks are summarized instead of listing every removed line
+        removed_count = len(changes)
+        first_old_line = numbered_lines[changes[0]][1]
+        return [format_hunk_header(first_old_line, removed_count, numbered_lines[changes[0]][2], 0, section),
+                f"\\ {removed_count} lines removed"]
+
+    keep = set()
+    for index in changes:
+        keep.update(range(max(0, index - context_lines), min(len(numbered_lines), index + context_lines + 1)))
+    for index, (line, _, _) in enumerate(numbered_lines):
+        if line.startswith('\\') and index - 1 in keep:
+            keep.add(index)
+
+    compacted = []
+    run = []
+    for index in range(len(numbered_lines) + 1):
+        if index < len(numbered_lines) and index in keep:
+            run.append(numbered_lines[index])
+            continue
+        if run:
+            old_count = sum(1 for line, _, _ in run if line[:1] in (' ', '-', ''))
+            new_count = sum(1 for line, _, _ in run if line[:1] in (' ', '+', ''))
+            compacted.append(format_hunk_header(run[0][1], old_count, run[0][2], new_count, section if not compacted else ""))
+            compacted.extend(line for line, _, _ in run)
+            run = []
+    return compacted
+
+def compact_patch(patch, context_lines=1, whitespace=True, keep_indentation=False):
+    lines = patch.split('\n')
+    compacted = []
+    header = None
+    hunk_lines = []
+
+    def flush():
+        if header is None:
+            return
+        if whitespace and is_whitespace_only(hunk_lines, keep_indentation):
+            return
+        compacted.extend(compact_hunk(header, hunk_lines, context_lines))
+
+    for line in lines:
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match:
+            flush()
+            header = match
+            hunk_lines = []
+        elif header is None:
+            compacted.append(line) # file headers before the first hunk
+        else:
+            hunk_lines.append(line.rstrip() if whitespace else line)
+    flush()
+    return '\n'.join(compacted)
+
+def truncate_patch(patch, max_tokens):
+    if estimate_tokens(patch) <= max_tokens:
+        return patch
+    lines = patch.split('\n')
+    kept = []
+    size = 0
+    for line in lines:
+        size += len(line) + 1
+        if size > max_tokens * 4:
+            break
+        kept.append(line)
+    kept.append(f"\\ {len(lines) - len(kept)} more lines truncated")
+    return '\n'.join(kept)
+
+def compact_files_diff(files_diff, context_lines=1, max_file_tokens=8000, whitespace=True):
+    # returns the compacted (filename, patch) tuples, and the bytes and estimated tokens saved
+    compacted = []
+    original_bytes = original_tokens = 0
+    compacted_bytes = compacted_tokens = 0
+    for filename, patch in files_diff:
+        original_bytes += len(patch)
+        original_tokens += estimate_tokens(patch)
+        omitted_reason = get_omitted_reason(filename, patch)
+        if omitted_reason:
+            changed_lines = sum(1 for line in patch.split('\n') if line[:1] in ('+', '-'))
+            compacted_patch = f"\\ diff omitted: {omitted_reason}, {changed_lines} lines changed"
+        else:
+            keep_indentation = bool(INDENTATION_SENSITIVE_PATTERN.search(filename))
+            compacted_patch = truncate_patch(compact_patch(patch, context_lines, whitespace, keep_indentation), max_file_tokens)
+            if not compacted_patch.strip():
+                compacted_patch = "\\ diff omitted: whitespace-only changes"
+        compacted_bytes += len(compacted_patch)
+        compacted_tokens += estimate_tokens(compacted_patch)
+        compacted.append((filename, compacted_patch))
+
+    stats = {
+        "files": len(files_diff),
+        "original_bytes": original_bytes,
+        "compacted_bytes": compacted_bytes,
+        "saved_bytes": original_bytes - compacted_bytes,
+        "saved_tokens": original_tokens - compacted_tokens
+    }
+    return compacted, stats
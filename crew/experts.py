@@ -1,8 +1,8 @@
 import os
+from functools import lru_cache
 from textwrap import dedent
-from crewai import Agent
-from crewai_tools import RagTool
-from langchain_openai import ChatOpenAI
+from crew.tasks import get_pr_context, verify_pr_context
+from crew.ollama import get_ollama_manager
 #from langchain_community.llms import Ollama
 
 def get_max_num_iterations(desired_num_iterations=5):
@@ -13,21 +13,108 @@ def get_max_num_iterations(desired_num_iterations=5):
         return max_num_iterations
     return desired_num_iterations
 
-def get_llm(openai="gpt-4",ollama="phi3:3.8b-mini-128k-instruct-q8_0", temperature=0):
+OPENAI_MODEL = "gpt-4"
+OLLAMA_MODEL = "phi3:3.8b-mini-128k-instruct-q8_0"
+MANAGER_MODEL = "gpt-4o"
+
+def get_model_tiers():
+    # models tried in order when validating a rule, from the cheapest to the strongest (CASCADE_MODELS='gpt-4o-mini,gpt-4');
+    # None stands for the default model
+    cascade = [model.strip() for model in (os.getenv('CASCADE_MODELS') or '').split(',') if model.strip()]
+    return cascade or [None]
+
+def get_cascade_min_score():
+    # minimum score for keeping a passing verdict from a model that isn't the last of the cascade
+    return int(os.getenv('CASCADE_MIN_SCORE') or 80)
+
+def get_model_kwargs(model):
+    # get_llm arguments for using the given model (None for the default one)
+    if os.getenv('LLM_TYPE') == "ollama":
+        # the default is the first model of the cascade, the one loaded at startup, so no other model gets pulled and kept
+        # in memory just for triage; without a cascade it's OLLAMA_MODEL
+        return {"ollama": model or get_model_tiers()[0] or OLLAMA_MODEL}
+    if model is None:
+        return {}
+    return {"openai": model}
+
+def get_model_name():
+    # name of the model(s) used by the agents, ie. for keying cached verdicts
+    tiers = get_model_tiers()
+    if os.getenv('LLM_TYPE') == "ollama":
+        return f"ollama:{'>'.join(model or OLLAMA_MODEL for model in tiers)}"
+    return f"openai:{'>'.join(model or OPENAI_MODEL for model in tiers)}"
+
+# crewai and langchain take seconds to import, so they're only loaded once the first agent or LLM client is built
+def new_agent(**kwargs):
+    from crewai import Agent
+    return Agent(**kwargs)
+
+@lru_cache(maxsize=None)
+def get_chat_class():
+    from langchain_openai import ChatOpenAI
+    from langchain_core.messages import SystemMessage
+
+    class ContextChatOpenAI(ChatOpenAI):
+        # sends the PR context of the current thread (see crew.tasks.pr_context) as the first message of every call, so
+        # the prompts of every rule and agent start with the same bytes and hit OpenAI's prompt cache or Ollama's KV cache
+        def with_pr_context(self, messages):
+            verify_pr_context([message.content for message in messages if isinstance(message.content, str)])
+            pr_context = get_pr_context()
+            if not pr_context:
+                return messages
+            return [SystemMessage(content=pr_context), *messages]
+
+        def _generate(self, messages, *args, **kwargs):
+            return super()._generate(self.with_pr_context(messages), *args, **kwargs)
+
+        async def _agenerate(self, messages, *args, **kwargs):
+            return await super()._agenerate(self.with_pr_context(messages), *args, **kwargs)
+
+        def _stream(self, messages, *args, **kwargs):
+            return super()._stream(self.with_pr_context(messages), *args, **kwargs)
+
+        def _astream(self, messages, *args, **kwargs):
+            return super()._astream(self.with_pr_context(messages), *args, **kwargs)
+
+    return ContextChatOpenAI
+
+def get_llm(openai=OPENAI_MODEL,ollama=OLLAMA_MODEL, temperature=0, http_client=None):
+    # http_client (httpx.Client) lets several LLM clients share pooled keep-alive connections;
+    # the scheduler retries failed calls itself, so the openai client's own retries are disabled
     if os.getenv('LLM_TYPE') == "ollama":
         base_url = os.getenv('OPENAI_API_BASE') or "http://localhost:11434"
+        # starts the server and downloads and loads the model on first use
+        get_ollama_manager(base_url).ensure_model(ollama)
         #return Ollama(model=ollama, temperature=temperature, num_predict=-1, base_url=base_url)
-        return ChatOpenAI(
+        return get_chat_class()(
             api_key="ollama",
             base_url=f"{base_url}/v1",
             temperature=0,
-            model = ollama)
+            model = ollama,
+            max_retries=0,
+            http_client=http_client)
     else:
-        return ChatOpenAI(model = openai, temperature=temperature)
+        return get_chat_class()(model = openai, temperature=temperature, max_retries=0, http_client=http_client)
+
+def with_callbacks(llm, callbacks):
+    # shallow copy of the LLM client with its own langchain callbacks, still sharing the pooled HTTP connections
+    return llm.copy(update={"callbacks": callbacks})
 
 class Experts():
+    def __init__(self, llm_factory=None, llm_callbacks=None):
+        # llm_factory builds the LLMs of the agents, ie. CrewSession.get_llm to reuse pooled clients;
+        # llm_callbacks(role) returns the callbacks for the LLM calls of each agent, ie. Metrics.callbacks to count its tokens
+        self.get_llm = llm_factory or get_llm
+        self.llm_callbacks = llm_callbacks
+
+    def agent_llm(self, role, llm=None):
+        llm = llm or self.get_llm()
+        if self.llm_callbacks is None:
+            return llm
+        return with_callbacks(llm, self.llm_callbacks(role))
+
     def rule_relevant_analyst(self):
-        return Agent(
+        return new_agent(
             role='Rule Relevance Analyst',
             goal='Determines if a rule is related to the PR or not. If the rule is not related, the agent will return false. If the rule is related, the agent will return true.',
             backstory=dedent("""\
@@ -39,11 +126,11 @@ class Experts():
             verbose=True,
             allow_delegation=False,
             max_iter=get_max_num_iterations(5),
-            llm=get_llm()
+            llm=self.agent_llm('Rule Relevance Analyst')
         )
 
     def compliance_specialist(self):
-        return Agent(
+        return new_agent(
             role='Compliance Specialist',
             goal='Oversees compliance checks and delegates to specialized experts if needed, always paying special focus to the defined rule, ignoring other comments that are not related to the specified rule.',
             tools=[],
@@ -52,16 +139,16 @@ class Experts():
                 and best practices, capable of identifying nuances in compliance about the requested rule."""),
             allow_delegation=True, # can delegate tasks to specialized experts
             max_iter=get_max_num_iterations(10),
-            llm=get_llm()
+            llm=self.agent_llm('Compliance Specialist')
             #verbose=True
         )
 
     def specialized_experts(self):
         # dict with array of specialized experts (python,java,database,security,etc.)
-        llm = get_llm()
+        llm = self.get_llm()
         return {
             "coding": [
-                Agent(
+                new_agent(
                     role='Python Expert',
                     goal='Provides opinions on Python-specific code regarding the requested rule.',
                     tools=[
@@ -75,12 +162,12 @@ class Experts():
                     """),
                     allow_delegation=True,
                     max_iter=get_max_num_iterations(2),
-                    llm = llm
+                    llm = self.agent_llm('Python Expert', llm)
                     #verbose=True
                 )
             ],
             "database": [
-                Agent(
+                new_agent(
                     role='SQL Expert',
                     goal='Provides opinions on SQL database-specific code regarding the requested rule.',
                     tools=[
@@ -94,14 +181,14 @@ class Experts():
                     """),
                     allow_delegation=False,
                     max_iter=get_max_num_iterations(2),
-                    llm = llm
+                    llm = self.agent_llm('SQL Expert', llm)
                     #verbose=True
                 )
             ]
         }
 
     def review_agent(self):
-        return Agent(
+        return new_agent(
             role='Review Agent',
             #goal='Verifies the accuracy of the Compliance Specialist’s assessment, consulting with specialized experts if needed, always in regards to the requested rule and nothing else.',
             goal='Verifies the accuracy of the Compliance Specialist’s assessment, always in regards to the requested rule and nothing else.',
@@ -110,13 +197,13 @@ class Experts():
                 An experienced reviewer with a background in code review and 
                 quality assurance, ensuring that compliance checks are correctly applied for the requested rule."""),
             #verbose=True,
-            llm = get_llm(),
+            llm = self.agent_llm('Review Agent'),
             max_iter=get_max_num_iterations(10),
             allow_delegation=False # Reviewer can delegate tasks to specialized experts
         )
 
     def feedback_agent(self):
-        return Agent(
+        return new_agent(
             role='Feedback Agent',
             goal='Generates a detailed feedback report based on the assessments for the specified rule. You query info to specialized experts if needed, always in regards to the requested rule and nothing else, for writting a better report.',
             tools=[],
@@ -126,6 +213,6 @@ class Experts():
             """),
             allow_delegation=True,
             max_iter=get_max_num_iterations(2),
-            llm = get_llm(),
+            llm = self.agent_llm('Feedback Agent'),
             #verbose=True
         )
@@ -0,0 +1,172 @@
+# Wall-clock time per stage, and LLM tokens and cost per rule, agent and model, for finding where a run spends its time
+import os, json, time, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+
+# USD per 1k (prompt, completion) tokens; models not listed (ie. ollama) are free
+# prompt tokens served from the provider's prompt cache are billed at CACHED_PROMPT_DISCOUNT of the prompt price
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.005, 0.015),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4": (0.03, 0.06),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+CACHED_PROMPT_DISCOUNT = 0.5
+
+def get_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    # matches the longest known model name prefix, ie. 'gpt-4o-2024-05-13' -> 'gpt-4o'
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if (model or "").startswith(name):
+            prompt_price, completion_price = MODEL_PRICES[name]
+            prompt_cost = (prompt_tokens - cached_tokens + cached_tokens * CACHED_PROMPT_DISCOUNT) * prompt_price
+            return (prompt_cost + completion_tokens * completion_price) / 1000
+    return 0.0
+
+def new_usage():
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "cost": 0.0}
+
+@lru_cache(maxsize=None)
+def get_token_usage_handler_class():
+    # langchain is only imported once the first agent is built, see crew.experts.new_agent
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class TokenUsageHandler(BaseCallbackHandler):
+        # langchain callback counting the tokens of every LLM call made by an agent
+        def __init__(self, metrics, agent):
+            self.metrics = metrics
+            self.agent = agent
+
+        def on_llm_end(self, response, **kwargs):
+            llm_output = response.llm_output or {}
+            usage = llm_output.get("token_usage") or {}
+            # prompt tokens served from OpenAI's prompt cache, ie. the shared PR context prefix
+            cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+            self.metrics.record_tokens(
+                self.agent,
+                llm_output.get("model_name"),
+                usage.get("prompt_tokens") or 0,
+                usage.get("completion_tokens") or 0,
+                cached_tokens
+            )
+
+    return TokenUsageHandler
+
+class Metrics():
+    def __init__(self, max_rules=None):
+        self.lock = threading.Lock()
+        # rule being validated by the current thread, set by stage()
+        self.local = threading.local()
+        self.started = time.time()
+        self.stages = {}
+        # with max_rules, only the most recently used rules are kept, ie. in the long-running service
+        self.max_rules = max_rules
+        self.rules = OrderedDict()
+        self.agents = {}
+        self.models = {}
+        self.total = new_usage()
+
+    def _rule(self, rule):
+        usage = self.rules.setdefault(rule, {"stages": {}, **new_usage()})
+        self.rules.move_to_end(rule)
+        if self.max_rules is not None and len(self.rules) > self.max_rules:
+            self.rules.popitem(last=False)
+        return usage
+
+    @contextmanager
+    def stage(self, name, rule=None):
+        # times the block as the given stage, attributing it (and its LLM calls) to the rule when given
+        previous_rule = getattr(self.local, "rule", None)
+        rule = rule if rule is not None else previous_rule
+        self.local.rule = rule
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.local.rule = previous_rule
+            with self.lock:
+                stage = self.stages.setdefault(name, {"count": 0, "seconds": 0.0})
+                stage["count"] += 1
+                stage["seconds"] += seconds
+                if rule is not None:
+                    rule_stages = self._rule(rule)["stages"]
+                    rule_stages[name] = rule_stages.get(name, 0.0) + seconds
+
+    def record_tokens(self, agent, model, prompt_tokens, completion_tokens, cached_tokens=0):
+        cost = get_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+        rule = getattr(self.local, "rule", None)
+        with self.lock:
+            usages = [self.total, self.agents.setdefault(agent, new_usage()), self.models.setdefault(model or "unknown", new_usage())]
+            if rule is not None:
+                usages.append(self._rule(rule))
+            for usage in usages:
+                usage["calls"] += 1
+                usage["prompt_tokens"] += prompt_tokens
+                usage["completion_tokens"] += completion_tokens
+                usage["cached_tokens"] += cached_tokens
+                usage["cost"] += cost
+
+    def callbacks(self, agent):
+        # callbacks to attach to the LLM of the given agent
+        return [get_token_usage_handler_class()(self, agent)]
+
+    def rule_tokens(self, rule):
+        with self.lock:
+            usage = self.rules.get(rule)
+            return usage["prompt_tokens"] + usage["completion_tokens"] if usage else 0
+
+    def cached_share(self):
+        # share of the prompt tokens served from the prompt cache
+        with self.lock:
+            return self.total["cached_tokens"] / self.total["prompt_tokens"] if self.total["prompt_tokens"] else 0.0
+
+    def report(self):
+        with self.lock:
+            return json.loads(json.dumps({
+                "started": self.started,
+                "seconds": time.time() - self.started,
+                "stages": self.stages,
+                "rules": self.rules,
+                "agents": self.agents,
+                "models": self.models,
+                "total": self.total
+            }))
+
+    def write_json(self, file_path):
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary_markdown(self):
+        report = self.report()
+        lines = [
+            "## PR Rules timings",
+            "",
+            f"Total: **{report['seconds']:.1f}s**, {report['total']['calls']} LLM calls, "
+            f"{report['total']['prompt_tokens']} prompt + {report['total']['completion_tokens']} completion tokens "
+            f"({report['total']['cached_tokens']} prompt tokens cached, {self.cached_share():.0%}), ${report['total']['cost']:.4f}",
+            "",
+            "| Stage | Count | Seconds |",
+            "| --- | ---: | ---: |",
+        ]
+        for name, stage in report["stages"].items():
+            lines.append(f"| {name} | {stage['count']} | {stage['seconds']:.1f} |")
+        lines += ["", "| Rule | Seconds | LLM calls | Prompt tokens | Cached tokens | Completion tokens | Cost |", "| --- | ---: | ---: | ---: | ---: | ---: | ---: |"]
+        for rule, usage in report["rules"].items():
+            rule_seconds = usage["stages"].get("rule", sum(usage["stages"].values()))
+            rule_text = rule.replace('|', '\\|')
+            lines.append(f"| {rule_text} | {rule_seconds:.1f} | {usage['calls']} | {usage['prompt_tokens']} | {usage['cached_tokens']} | {usage['completion_tokens']} | ${usage['cost']:.4f} |")
+        lines += ["", "| Agent | LLM calls | Prompt tokens | Cached tokens | Completion tokens | Cost |", "| --- | ---: | ---: | ---: | ---: | ---: |"]
+        for agent, usage in report["agents"].items():
+            lines.append(f"| {agent} | {usage['calls']} | {usage['prompt_tokens']} | {usage['cached_tokens']} | {usage['completion_tokens']} | ${usage['cost']:.4f} |")
+        return "\n".join(lines) + "\n"
+
+    def write_step_summary(self):
+        # appends the summary tables to the GitHub Actions job summary, when running inside an action
+        summary_path = os.getenv('GITHUB_STEP_SUMMARY')
+        if not summary_path:
+            return
+        with open(summary_path, 'a', encoding='utf-8') as f:
+            f.write(self.summary_markdown())
@@ -0,0 +1,112 @@
+# Local model lifecycle on the Ollama path: starts the server when needed, waits until it answers,
+# downloads missing models into the (cacheable) models directory, and keeps them loaded across rules
+import os, time, shutil, threading, subprocess
+import httpx
+
+def get_keep_alive():
+    # how long Ollama keeps a model loaded after its last request
+    return os.getenv('OLLAMA_KEEP_ALIVE') or "30m"
+
+def get_models_dir():
+    # OLLAMA_MODELS, or the models folder of the OLLAMA_DIR installation (see install_ollama.sh); None for Ollama's default
+    if os.getenv('OLLAMA_MODELS'):
+        return os.getenv('OLLAMA_MODELS')
+    if os.getenv('OLLAMA_DIR'):
+        return os.path.join(os.getenv('OLLAMA_DIR'), "models")
+    return None
+
+class OllamaManager():
+    def __init__(self, base_url="http://localhost:11434", startup_timeout=None):
+        self.base_url = base_url.rstrip('/')
+        self.startup_timeout = startup_timeout or float(os.getenv('OLLAMA_STARTUP_TIMEOUT') or 120)
+        self.client = httpx.Client(base_url=self.base_url, timeout=httpx.Timeout(None, connect=5))
+        self.lock = threading.Lock()
+        self.model_locks = {}
+        self.ready_models = set()
+        self.server = None
+        self.stats = {"server_seconds": 0.0, "pull_seconds": 0.0, "load_seconds": 0.0, "pulled": []}
+
+    def is_ready(self):
+        try:
+            return self.client.get("/api/version", timeout=2).status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    def start_server(self):
+        # starts 'ollama serve' unless a server already answers, then waits for it
+        with self.lock:
+            if self.is_ready():
+                return
+            start = time.perf_counter()
+            if self.server is None:
+                binary = shutil.which("ollama") or (os.path.join(os.getenv('OLLAMA_DIR'), "bin", "ollama") if os.getenv('OLLAMA_DIR') else None)
+                if not binary or not os.path.exists(binary):
+                    raise RuntimeError(f"Ollama isn't running at {self.base_url} and isn't installed")
+                env = dict(os.environ, OLLAMA_KEEP_ALIVE=get_keep_alive())
+                if get_models_dir():
+                    os.makedirs(get_models_dir(), exist_ok=True)
+                    env["OLLAMA_MODELS"] = get_models_dir()
+                print(f"Starting Ollama server ({binary})...")
+                self.server = subprocess.Popen([binary, "serve"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+            delay = 0.1
+            while not self.is_ready():
+                if time.perf_counter() - start > self.startup_timeout:
+                    raise RuntimeError(f"Ollama server didn't answer at {self.base_url} within {self.startup_timeout:.0f}s")
+                if self.server.poll() is not None:
+                    raise RuntimeError(f"Ollama server exited with code {self.server.returncode}")
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+            self.stats["server_seconds"] += time.perf_counter() - start
+
+    def has_model(self, model):
+        response = self.client.get("/api/tags")
+        response.raise_for_status()
+        names = set()
+        for item in response.json().get("models", []):
+            names.update((item.get("name"), item.get("model")))
+        return model in names or f"{model}:latest" in names
+
+    def pull(self, model):
+        print(f"Downloading Ollama model {model}...")
+        start = time.perf_counter()
+        response = self.client.post("/api/pull", json={"model": model, "name": model, "stream": False})
+        response.raise_for_status()
+        self.stats["pull_seconds"] += time.perf_counter() - start
+        self.stats["pulled"].append(model)
+
+    def warm_up(self, model):
+        # a request without prompt loads the model into memory, where keep_alive keeps it between rules
+        start = time.perf_counter()
+        response = self.client.post("/api/generate", json={"model": model, "keep_alive": get_keep_alive()})
+        response.raise_for_status()
+        self.stats["load_seconds"] += time.perf_counter() - start
+
+    def ensure_model(self, model):
+        # makes the model ready to answer, only once per model; concurrent callers wait for the first one
+        with self.lock:
+            model_lock = self.model_locks.setdefault(model, threading.Lock())
+        with model_lock:
+            if model in self.ready_models:
+                return
+            start = time.perf_counter()
+            self.start_server()
+            if not self.has_model(model):
+                self.pull(model)
+            self.warm_up(model)
+            self.ready_models.add(model)
+            print(f"Ollama model {model} ready in {time.perf_counter() - start:.1f}s ({self.summary()})")
+
+    def summary(self):
+        pulled = f", downloaded {', '.join(self.stats['pulled'])}" if self.stats["pulled"] else ", from cache"
+        return (f"server {self.stats['server_seconds']:.1f}s, download {self.stats['pull_seconds']:.1f}s, "
+                f"load {self.stats['load_seconds']:.1f}s{pulled}")
+
+MANAGERS = {}
+MANAGERS_LOCK = threading.Lock()
+
+def get_ollama_manager(base_url="http://localhost:11434"):
+    # one manager per server for the whole process
+    with MANAGERS_LOCK:
+        if base_url not in MANAGERS:
+            MANAGERS[base_url] = OllamaManager(base_url)
+        return MANAGERS[base_url]
@@ -0,0 +1,114 @@
+# Routes each rule to the subset of changed files it can apply to
+import os, re, fnmatch
+from typing import List, Optional
+from crew.tasks import PRSchema
+
+LANGUAGES = {
+    'python': ('.py', '.pyi'),
+    'javascript': ('.js', '.jsx', '.mjs', '.cjs'),
+    'typescript': ('.ts', '.tsx'),
+    'java': ('.java', '.kt', '.kts'),
+    'go': ('.go',),
+    'ruby': ('.rb',),
+    'php': ('.php',),
+    'csharp': ('.cs',),
+    'c': ('.c', '.h', '.cpp', '.hpp', '.cc'),
+    'rust': ('.rs',),
+    'swift': ('.swift',),
+    'sql': ('.sql',),
+    'shell': ('.sh', '.bash'),
+    'html': ('.html', '.htm', '.vue', '.svelte'),
+    'css': ('.css', '.scss', '.sass', '.less'),
+}
+DOCS_EXTENSIONS = ('.md', '.rst', '.txt', '.adoc')
+CONFIG_EXTENSIONS = ('.json', '.yml', '.yaml', '.toml', '.ini', '.cfg', '.xml', '.env')
+LOCKFILE_NAMES = ('package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'poetry.lock', 'Pipfile.lock', 'Cargo.lock', 'composer.lock', 'Gemfile.lock', 'go.sum')
+ASSET_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.pdf', '.woff', '.woff2', '.ttf', '.zip')
+
+# scope inferred from the rule text when it has no annotation, from the most to the least specific;
+# rules asking for something to be present (ie. "must include tests") need to see every file, so they keep the 'all' scope
+REQUIREMENT_PATTERN = re.compile(r"\b(?:must|should|needs? to)\s+(?:include|add|update|contain|have|be accompanied)\b|\brequire[sd]?\b", re.IGNORECASE)
+INFERRED_SCOPES = [
+    (re.compile(r"\bpython\b", re.IGNORECASE), ['python']),
+    (re.compile(r"\b(?:javascript|node(?:\.js)?|js)\b", re.IGNORECASE), ['javascript', 'typescript']),
+    (re.compile(r"\btypescript\b", re.IGNORECASE), ['typescript']),
+    (re.compile(r"\b(?:code|variables?|functions?|methods?|class(?:es)?|imports?|sql|diffs?)\b", re.IGNORECASE), ['code']),
+    (re.compile(r"\b(?:title|description|body)\b", re.IGNORECASE), ['pr']),
+]
+
+def get_language(filename):
+    lower_filename = filename.lower()
+    for language, extensions in LANGUAGES.items():
+        if lower_filename.endswith(extensions):
+            return language
+    return None
+
+def get_category(filename):
+    basename = os.path.basename(filename)
+    lower_filename = filename.lower()
+    if basename in LOCKFILE_NAMES:
+        return 'lockfile'
+    if lower_filename.endswith(ASSET_EXTENSIONS):
+        return 'asset'
+    if get_language(filename):
+        return 'code'
+    if lower_filename.endswith(DOCS_EXTENSIONS) or basename.upper().startswith(('LICENSE', 'CHANGELOG')):
+        return 'docs'
+    if lower_filename.endswith(CONFIG_EXTENSIONS) or basename in ('Dockerfile', 'Makefile'):
+        return 'config'
+    return 'other'
+
+def parse_scope(scope_str) -> Optional[List[str]]:
+    # 'python, migrations/*.sql' -> ['python', 'migrations/*.sql']
+    scope = [entry.strip() for entry in (scope_str or '').split(',') if entry.strip()]
+    return scope or None
+
+def is_requirement_rule(rule: str) -> bool:
+    # whether the rule asks for something to be present in the PR, ie. "must include tests"
+    return REQUIREMENT_PATTERN.search(rule) is not None
+
+def infer_scope(rule: str) -> List[str]:
+    if is_requirement_rule(rule):
+        return ['all']
+    for pattern, scope in INFERRED_SCOPES:
+        if pattern.search(rule):
+            return scope
+    return ['all']
+
+class FileIndex():
+    # index of the changed files by language, category and path, built once per PR
+    def __init__(self, files_diff):
+        self.files = [{
+            "filename": filename,
+            "patch": patch,
+            "language": get_language(filename),
+            "category": get_category(filename)
+        } for filename, patch in files_diff]
+
+    def matches(self, file, entry):
+        # scope entries are 'all', a category, a language, 'contains:<regex>' over the patch, or a path glob
+        lower_entry = entry.lower()
+        if lower_entry == 'all':
+            return True
+        if lower_entry in ('code', 'docs', 'config', 'lockfile', 'asset', 'other'):
+            return file["category"] == lower_entry
+        if lower_entry in LANGUAGES:
+            return file["language"] == lower_entry
+        if lower_entry.startswith('contains:'):
+            return re.search(entry[len('contains:'):], file["patch"], re.IGNORECASE) is not None
+        if '/' not in entry:
+            return fnmatch.fnmatch(os.path.basename(file["filename"]), entry)
+        return fnmatch.fnmatch(file["filename"], entry)
+
+    def select(self, scope: List[str]):
+        # returns the (filename, patch) tuples matching any of the scope entries, in diff order
+        return [(file["filename"], file["patch"]) for file in self.files if any(self.matches(file, entry) for entry in scope)]
+
+def route_rule(index: FileIndex, PR: PRSchema, rule: str, scope: Optional[List[str]] = None):
+    # returns the PR as seen by the rule, or None when none of the changed files are in its scope;
+    # the 'pr' scope only looks at the PR title and body, so it never routes files
+    scope = scope or infer_scope(rule)
+    files_diff = index.select([entry for entry in scope if entry.lower() != 'pr'])
+    if not files_diff and not any(entry.lower() == 'pr' for entry in scope):
+        return None
+    return PRSchema(title=PR.title, body=PR.body, files_diff=files_diff)
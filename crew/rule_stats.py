@@ -0,0 +1,63 @@
+# Persistent per-rule statistics, used to validate first the rules most likely to fail a PR quickly
+import os, json, hashlib, threading
+
+# assumed for rules without history
+DEFAULT_SECONDS = 30.0
+
+class RuleStats():
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.rules = {}
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                self.rules = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ignoring unreadable rule stats {file_path}: {e}")
+
+    def key(self, rule: str):
+        return hashlib.sha256(rule.encode('utf-8')).hexdigest()[:16]
+
+    def record(self, rule: str, complies: bool, seconds: float, tokens: int = 0):
+        # running means over every crew validation of the rule
+        with self.lock:
+            stats = self.rules.setdefault(self.key(rule), {"runs": 0, "failures": 0, "mean_seconds": 0.0, "mean_tokens": 0.0})
+            stats["runs"] += 1
+            stats["failures"] += 0 if complies else 1
+            stats["mean_seconds"] += (seconds - stats["mean_seconds"]) / stats["runs"]
+            stats["mean_tokens"] += (tokens - stats["mean_tokens"]) / stats["runs"]
+
+    def failure_rate(self, rule: str):
+        # smoothed, so rules without history count as failing half of the time
+        stats = self.rules.get(self.key(rule), {"runs": 0, "failures": 0})
+        return (stats["failures"] + 1) / (stats["runs"] + 2)
+
+    def cost(self, rule: str):
+        # (mean seconds, mean tokens) of validating the rule
+        stats = self.rules.get(self.key(rule))
+        if not stats:
+            return DEFAULT_SECONDS, 0.0
+        return stats["mean_seconds"], stats["mean_tokens"]
+
+    def order(self, checklist_items, skip_cost=()):
+        # returns the indexes of checklist_items in evaluation order: mandatory rules first, by failure rate per second,
+        # then warnings in file order; rules in skip_cost don't need the crew, so they're free to evaluate first
+        def priority(index):
+            rule = checklist_items[index]
+            if rule.text in skip_cost:
+                return (0, 0.0, 0.0, index)
+            if rule.type != 'mandatory':
+                return (2, 0.0, 0.0, index)
+            seconds, tokens = self.cost(rule.text)
+            return (1, -self.failure_rate(rule.text) / max(seconds, 0.1), tokens, index)
+        return sorted(range(len(checklist_items)), key=priority)
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.file_path)), exist_ok=True)
+            tmp_path = f"{self.file_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.rules, f, indent=2)
+            os.replace(tmp_path, self.file_path)
@@ -1,36 +1,165 @@
 # Defines a 'Team of Experts & Tasks' for validating a given PR against a given rule
-from crewai import Crew, Process
-from crew.experts import Experts, get_llm
-from crew.tasks import Tasks, PRSchema, RulesOutput
+from crew.tasks import Tasks, PRSchema, RulesOutput, pr_context
+from crew.chunking import chunk_files_diff, merge_outputs
+from crew.routing import is_requirement_rule
+from crew.session import CrewSession
+from crew.experts import get_model_tiers, get_cascade_min_score, MANAGER_MODEL
+from typing import List
 import os
 
-def validate_rule(PR: PRSchema, rule: str):
-    # Define the team
-    expert = Experts()
-    rule_validator = expert.rule_relevant_analyst()
-    compliance_specialist = expert.compliance_specialist()
-    specialized_experts = expert.specialized_experts()
-    review_agent = expert.review_agent() # for ollama
-    feedback_agent = expert.feedback_agent()
+def new_crew(**kwargs):
+    # crewai is only imported once the first crew is built, see crew.experts.new_agent
+    from crewai import Crew
+    return Crew(**kwargs)
 
-    # Define the tasks
-    my_tasks = Tasks(PR, rule)
-    is_rule_relevant = my_tasks.is_rule_relevant(rule_validator)
+def triage_rules(PR: PRSchema, rules: List[str], session: CrewSession = None):
+    # asks for the relevance of every rule at once, instead of running one relevance crew per rule;
+    # returns {rule: is_relevant}, leaving out the rules the LLM didn't answer for
+    session = session or CrewSession()
+    chunks = chunk_files_diff(PR.files_diff)
+    answers = {rule: [] for rule in rules}
+    for index, chunk in enumerate(chunks):
+        # a rule relevant for any chunk is relevant for the PR
+        pending = [rule for rule in rules if True not in answers[rule]]
+        if not pending:
+            break
+        print(f"Starting Triage Crew for {len(pending)} rules (chunk {index+1}/{len(chunks)})")
+        rule_validator = session.get_agents()["rule_validator"]
+        chunk_schema = PRSchema(title=PR.title, body=PR.body, files_diff=chunk, part=(index+1, len(chunks)) if len(chunks) > 1 else None)
+        triage_task = Tasks(chunk_schema, None).are_rules_relevant(rule_validator, pending)
+        triage_crew = new_crew(
+            agents=[rule_validator],
+            tasks=[triage_task]
+        )
+        try:
+            with session.metrics.stage("triage_crew"), pr_context(chunk_schema):
+                output = triage_crew.kickoff()
+            for item in output.rules:
+                if 1 <= item.rule_number <= len(pending):
+                    answers[pending[item.rule_number-1]].append(item.is_relevant)
+        except Exception as e:
+            print(f"Error triaging rules, they will be checked one by one: {e}")
+            break
+
+    relevance = {}
+    for rule, rule_answers in answers.items():
+        if True in rule_answers:
+            relevance[rule] = True
+        elif len(rule_answers) == len(chunks):
+            relevance[rule] = False
+    print("output from triage task", relevance)
+    return relevance
 
-    # kick off the first task to see if we need to prceed with the rest of the tasks
-    test_crew = Crew(
-        agents=[rule_validator],
-        tasks=[is_rule_relevant],
-        #verbose=2
+def validate_rules_batch(PR: PRSchema, rules: List[str], session: CrewSession = None, min_confidence=70):
+    # checks several rules against the same PR in a single call; returns {rule: RulesOutput} for the confident
+    # and well-formed answers only, the other rules should be validated one by one with validate_rule
+    session = session or CrewSession()
+    compliance_specialist = session.get_agents()["compliance_specialist"]
+    batch_task = Tasks(PR, None).check_rules_complaince(compliance_specialist, rules)
+    batch_crew = new_crew(
+        agents=[compliance_specialist],
+        tasks=[batch_task],
+        memory=False
     )
-    print("Starting Validation Crew")
-    is_valid = test_crew.kickoff()
-    print("output from initial validation task",is_valid)
+    print(f"Starting Batch Compliance Crew for {len(rules)} rules")
+    try:
+        with session.metrics.stage("batch_compliance_crew"), pr_context(PR):
+            output = batch_crew.kickoff()
+        items = output.rules
+    except Exception as e:
+        print(f"Error checking rules in batch, they will be checked one by one: {e}")
+        return {}
 
-    if is_valid.is_relevant == False:
-        print("Rule is not relevant to the PR context")
+    verdicts = {}
+    for item in items:
+        if not 1 <= item.rule_number <= len(rules):
+            continue
+        # a score contradicting the verdict, or a failure without reasons, isn't trusted
+        confidence = item.score if item.complies else 100 - item.score
+        if confidence < min_confidence or (not item.complies and not item.affected_sections):
+            continue
+        verdicts[rules[item.rule_number-1]] = RulesOutput(
+            complies=item.complies,
+            score=item.score,
+            affected_sections=item.affected_sections
+        )
+    print(f"Batch Compliance Crew settled {len(verdicts)}/{len(rules)} rules")
+    return verdicts
+
+def validate_rule(PR: PRSchema, rule: str, cancel_event=None, session: CrewSession = None, is_relevant=None):
+    # cancel_event (threading.Event) is set by the caller when this rule's result is no longer needed,
+    # in which case we return None instead of starting the next crew;
+    # session shares LLM clients and agents across the rules of a run, a new one is used if not given;
+    # is_relevant comes from triage_rules, skipping the relevance crew when known
+    print(f"Checking rule: {rule}")
+    if is_relevant == False:
+        print("Rule is not relevant to the PR context (triage)")
         return RulesOutput(complies=True,affected_sections=None,score=100)
-        #return { "is_relevant": False } # Rule is not relevant to the PR
+    session = session or CrewSession()
+    # model cascade: cheaper models go first, and their verdict is kept only if it complies with a high enough score;
+    # borderline and failing verdicts are escalated to the next model
+    tiers = get_model_tiers()
+    for tier, model in enumerate(tiers):
+        is_last_tier = tier == len(tiers) - 1
+        output = validate_rule_chunks(PR, rule, cancel_event, session, is_relevant, model, MANAGER_MODEL if is_last_tier else model)
+        if output is None:
+            return None
+        if is_last_tier or (output.complies and output.score >= get_cascade_min_score()):
+            session.record_tier(model)
+            return output
+        print(f"Verdict from {model} not confident enough (score {output.score}), escalating rule: {rule}")
+        # the rule was found relevant (or the verdict would have been a confident pass), no need to ask again
+        is_relevant = True
+
+def validate_rule_chunks(PR: PRSchema, rule: str, cancel_event=None, session: CrewSession = None, is_relevant=None, model=None, manager_model=MANAGER_MODEL):
+    # big PRs are validated in token-budgeted chunks of files, and the chunk verdicts merged into one
+    chunks = chunk_files_diff(PR.files_diff)
+    if len(chunks) == 1:
+        return validate_rule_chunk(PR, rule, cancel_event, session, is_relevant, model, manager_model)
+
+    outputs = []
+    for index, chunk in enumerate(chunks):
+        print(f"Validating chunk {index+1}/{len(chunks)} ({len(chunk)} diffs) for rule: {rule}")
+        chunk_schema = PRSchema(title=PR.title, body=PR.body, files_diff=chunk, part=(index+1, len(chunks)))
+        output = validate_rule_chunk(chunk_schema, rule, cancel_event, session, is_relevant, model, manager_model)
+        if output is None:
+            return None
+        outputs.append(output)
+    return merge_outputs(outputs, requirement=is_requirement_rule(rule))
+
+def validate_rule_chunk(PR: PRSchema, rule: str, cancel_event=None, session: CrewSession = None, is_relevant=None, model=None, manager_model=MANAGER_MODEL):
+    # Define the team, using the given model (None for the default one)
+    agents = session.get_agents(model)
+    rule_validator = agents["rule_validator"]
+    compliance_specialist = agents["compliance_specialist"]
+    specialized_experts = agents["specialized_experts"]
+    review_agent = agents["review_agent"] # for ollama
+    feedback_agent = agents["feedback_agent"]
+
+    # Define the tasks
+    my_tasks = Tasks(PR, rule)
+
+    # kick off the first task to see if we need to prceed with the rest of the tasks, unless triage already told us
+    if is_relevant is None:
+        is_rule_relevant = my_tasks.is_rule_relevant(rule_validator)
+        test_crew = new_crew(
+            agents=[rule_validator],
+            tasks=[is_rule_relevant],
+            #verbose=2
+        )
+        print("Starting Validation Crew")
+        with session.metrics.stage("relevance_crew", rule), pr_context(PR):
+            is_valid = test_crew.kickoff()
+        print("output from initial validation task",is_valid)
+
+        if is_valid.is_relevant == False:
+            print("Rule is not relevant to the PR context")
+            return RulesOutput(complies=True,affected_sections=None,score=100)
+            #return { "is_relevant": False } # Rule is not relevant to the PR
+
+    if cancel_event is not None and cancel_event.is_set():
+        print("Validation cancelled for rule: "+rule)
+        return None
 
     print("Rule seems valid for PR context, proceeding with the rest of the tasks")
     # define the rest of the tasks
@@ -41,11 +170,10 @@ def validate_rule(PR: PRSchema, rule: str):
 
     # Define the final evaluation crew
     print("executing review crew for rule: "+rule)
-    manager_llm = get_llm(openai="gpt-4o")
     if os.getenv('LLM_TYPE') == "ollama":
         #verify_assessment = my_tasks.verify_assessment(review_agent, check_compliance)
         #generate_feedback = my_tasks.generate_feedback(feedback_agent, verify_assessment)
-        crew = Crew(
+        crew = new_crew(
             agents=[ # include available specialiazied experts here as well
                 compliance_specialist, *specialized_experts["coding"], *specialized_experts["database"],
                 #review_agent, 
@@ -61,13 +189,17 @@ def validate_rule(PR: PRSchema, rule: str):
             #verbose=1,
             memory=False,
         )
-        return crew.kickoff()
+        with session.metrics.stage("compliance_crew", rule), pr_context(PR):
+            return crew.kickoff()
         #report = crew.kickoff()
         #print("transforming report into pydantic model:\n",report)
         #return output_to_pydantic(report, RulesOutput)
     
     else:
-        crew = Crew(
+        # only hierarchical crews have a manager; on ollama building its client would also load another model
+        from crewai import Process
+        manager_llm = session.get_llm(openai=manager_model, agent='Crew Manager')
+        crew = new_crew(
             agents=[ # include available specialiazied experts here as well
                 compliance_specialist, *specialized_experts["coding"], *specialized_experts["database"],
                 #review_agent, 
@@ -82,4 +214,5 @@ def validate_rule(PR: PRSchema, rule: str):
             process=Process.hierarchical,
             memory=True
         )
-        return crew.kickoff()
+        with session.metrics.stage("compliance_crew", rule), pr_context(PR):
+            return crew.kickoff()
@@ -0,0 +1,214 @@
+# Shared rate limiting for the LLM and GitHub API calls: token buckets for requests and tokens per minute,
+# a concurrency cap, and retries with jittered exponential backoff that follow the servers' Retry-After hints
+import os, re, time, random, threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import httpx
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504, 529)
+RETRYABLE_ERRORS = ('ConnectionError', 'ConnectTimeout', 'ReadTimeout', 'Timeout', 'ChunkedEncodingError', 'RemoteDisconnected')
+DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+
+class TokenBucket():
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        # takes amount from the bucket (going into debt if needed), returning the seconds to wait before using it;
+        # amounts over the capacity are capped, so a single big request can't block forever
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+            self.updated = now
+            self.available -= min(amount, self.capacity)
+            return 0.0 if self.available >= 0 else -self.available / self.rate
+
+def parse_duration(value):
+    # OpenAI's x-ratelimit-reset-* headers, ie. '1s', '6m0s' or '20ms'
+    seconds = 0.0
+    for amount, unit in DURATION_PATTERN.findall(value or ''):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds or None
+
+def get_retry_after(headers):
+    # seconds the server asked us to wait, or None
+    if not headers:
+        return None
+    headers = {key.lower(): value for key, value in dict(headers).items()}
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except Exception:
+                pass
+    # GitHub's primary rate limit
+    if headers.get('x-ratelimit-remaining') == '0' and headers.get('x-ratelimit-reset'):
+        try:
+            return max(0.0, float(headers['x-ratelimit-reset']) - time.time())
+        except ValueError:
+            pass
+    # OpenAI's limits
+    if headers.get('x-ratelimit-remaining-requests') == '0':
+        return parse_duration(headers.get('x-ratelimit-reset-requests'))
+    if headers.get('x-ratelimit-remaining-tokens') == '0':
+        return parse_duration(headers.get('x-ratelimit-reset-tokens'))
+    return None
+
+def get_error_details(error):
+    # (status, headers) of an API error from PyGithub, openai or httpx, (None, None) for other errors
+    status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+    response = getattr(error, 'response', None)
+    headers = getattr(error, 'headers', None) or getattr(response, 'headers', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    return (status if isinstance(status, int) else None), headers
+
+def is_retryable_error(error):
+    status, headers = get_error_details(error)
+    if status in RETRYABLE_STATUSES:
+        return True
+    # GitHub answers rate limited requests with 403s
+    if status == 403 and (get_retry_after(headers) is not None or 'rate limit' in str(error).lower()):
+        return True
+    return status is None and type(error).__name__ in RETRYABLE_ERRORS
+
+class Scheduler():
+    # every call of a kind (ie. all the LLM requests of the run) goes through the same scheduler
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0, max_concurrency=0, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # a rate limited answer pauses every caller, not only the one retrying
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "retries": 0, "waited_seconds": 0.0}
+
+    def wait(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+            with self.lock:
+                self.stats["waited_seconds"] += seconds
+
+    @contextmanager
+    def slot(self, tokens=0):
+        # waits for the rate limits and a free slot, holding the slot for the duration of the call
+        self.wait(self.paused_until - time.monotonic())
+        if self.semaphore is not None:
+            self.semaphore.acquire()
+        try:
+            delay = 0.0
+            if self.requests is not None:
+                delay = max(delay, self.requests.reserve(1))
+            if self.tokens is not None and tokens:
+                delay = max(delay, self.tokens.reserve(tokens))
+            self.wait(delay)
+            with self.lock:
+                self.stats["calls"] += 1
+            yield
+        finally:
+            if self.semaphore is not None:
+                self.semaphore.release()
+
+    def retry_delay(self, attempt, retry_after=None):
+        # returns the seconds to wait before retrying, or None when we shouldn't retry anymore
+        if attempt >= self.max_retries:
+            return None
+        if retry_after is not None:
+            if retry_after > self.max_delay:
+                return None
+            delay = retry_after + random.uniform(0, self.base_delay)
+            with self.lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        else:
+            delay = random.uniform(0.5, 1.0) * min(self.max_delay, self.base_delay * 2 ** attempt)
+        with self.lock:
+            self.stats["retries"] += 1
+        return delay
+
+    def call(self, fn, *args, tokens=0, **kwargs):
+        # runs fn(*args, **kwargs) within the limits, retrying it on rate limits and transient errors
+        attempt = 0
+        while True:
+            try:
+                with self.slot(tokens):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                delay = self.retry_delay(attempt, get_retry_after(get_error_details(e)[1]))
+                if delay is None:
+                    raise
+                print(f"{self.name} call failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+                self.wait(delay)
+                attempt += 1
+
+    def summary(self):
+        return f"{self.stats['calls']} calls, {self.stats['retries']} retries, {self.stats['waited_seconds']:.1f}s waiting for rate limits"
+
+class ScheduledTransport(httpx.BaseTransport):
+    # httpx transport sending every request of an HTTP client (ie. the LLM clients of a session) through a scheduler
+    def __init__(self, scheduler: Scheduler, transport: httpx.BaseTransport = None):
+        self.scheduler = scheduler
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request):
+        # prompts are ~4 bytes per token, like estimate_tokens
+        tokens = (len(request.read()) + 3) // 4
+        attempt = 0
+        while True:
+            try:
+                with self.scheduler.slot(tokens):
+                    response = self.transport.handle_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError, httpx.ReadError) as e:
+                delay = self.scheduler.retry_delay(attempt)
+                if delay is None:
+                    raise
+                print(f"{self.scheduler.name} request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+                self.scheduler.wait(delay)
+                attempt += 1
+                continue
+            if response.status_code not in RETRYABLE_STATUSES:
+                return response
+            delay = self.scheduler.retry_delay(attempt, get_retry_after(response.headers))
+            if delay is None:
+                return response
+            response.read()
+            response.close()
+            print(f"{self.scheduler.name} request got {response.status_code}, retrying in {delay:.1f}s")
+            self.scheduler.wait(delay)
+            attempt += 1
+
+    def close(self):
+        self.transport.close()
+
+# env prefix of the settings of each shared scheduler
+SCHEDULER_ENV_PREFIXES = {"llm": "LLM", "github": "GH_API"}
+SCHEDULERS = {}
+SCHEDULERS_LOCK = threading.Lock()
+
+def get_scheduler(name):
+    # returns the scheduler shared by the whole process for the given kind of calls ('llm' or 'github'),
+    # ie. LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_CONCURRENCY and LLM_MAX_RETRIES (0 = no limit)
+    with SCHEDULERS_LOCK:
+        if name not in SCHEDULERS:
+            prefix = SCHEDULER_ENV_PREFIXES[name]
+            SCHEDULERS[name] = Scheduler(
+                name,
+                requests_per_minute=float(os.getenv(f'{prefix}_REQUESTS_PER_MINUTE') or 0),
+                tokens_per_minute=float(os.getenv(f'{prefix}_TOKENS_PER_MINUTE') or 0),
+                # GitHub asks for serial requests to avoid its secondary rate limits
+                max_concurrency=int(os.getenv(f'{prefix}_MAX_CONCURRENCY') or (8 if name == "llm" else 1)),
+                max_retries=int(os.getenv(f'{prefix}_MAX_RETRIES') or 5)
+            )
+        return SCHEDULERS[name]
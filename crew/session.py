@@ -0,0 +1,89 @@
+# Run-scoped session sharing LLM clients, HTTP connections and agents across every rule validation
+import os, time, threading
+from functools import partial
+import httpx
+from crew.experts import Experts, get_llm, with_callbacks, get_model_kwargs, OPENAI_MODEL, OLLAMA_MODEL
+from crew.metrics import Metrics
+from crew.scheduler import ScheduledTransport, get_scheduler
+
+class CrewSession():
+    def __init__(self, reuse=True, metrics=None):
+        # with reuse=False every call builds new clients and agents, like before sessions existed,
+        # which is useful to compare the setup overhead; metrics collects the timings and token usage of the crews
+        self.reuse = reuse
+        self.metrics = metrics or Metrics()
+        # every LLM request goes through the shared rate limits; without reuse, connections aren't kept alive either
+        self.http_client = httpx.Client(
+            transport=ScheduledTransport(get_scheduler("llm"), httpx.HTTPTransport(
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=20 if reuse else 0, keepalive_expiry=300)
+            )),
+            timeout=httpx.Timeout(600, connect=10)
+        )
+        self.llms = {}
+        self.lock = threading.Lock()
+        # agents keep execution state while they work, so each worker thread gets its own sets
+        self.local = threading.local()
+        self.stats = {
+            "llm_clients": 0,
+            "llm_seconds": 0.0,
+            "agent_sets": 0,
+            "agent_seconds": 0.0,
+            "tiers": {}
+        }
+
+    def get_llm(self, openai=OPENAI_MODEL, ollama=OLLAMA_MODEL, temperature=0, agent=None):
+        # agent names the caller for the token usage metrics, ie. the manager of a hierarchical crew
+        llm = self.get_shared_llm(openai, ollama, temperature)
+        return with_callbacks(llm, self.metrics.callbacks(agent)) if agent else llm
+
+    def get_shared_llm(self, openai=OPENAI_MODEL, ollama=OLLAMA_MODEL, temperature=0):
+        key = (os.getenv('LLM_TYPE'), openai, ollama, temperature)
+        with self.lock:
+            if self.reuse and key in self.llms:
+                return self.llms[key]
+            start = time.perf_counter()
+            llm = get_llm(openai=openai, ollama=ollama, temperature=temperature, http_client=self.http_client)
+            self.stats["llm_clients"] += 1
+            self.stats["llm_seconds"] += time.perf_counter() - start
+            if self.reuse:
+                self.llms[key] = llm
+            return llm
+
+    def get_agents(self, model=None):
+        # returns the team of experts using the given model (None for the default one) for the current thread
+        if not hasattr(self.local, "agents"):
+            self.local.agents = {}
+        agents = self.local.agents.get(model)
+        if agents is not None and self.reuse:
+            return agents
+        start = time.perf_counter()
+        expert = Experts(partial(self.get_shared_llm, **get_model_kwargs(model)), self.metrics.callbacks)
+        agents = {
+            "rule_validator": expert.rule_relevant_analyst(),
+            "compliance_specialist": expert.compliance_specialist(),
+            "specialized_experts": expert.specialized_experts(),
+            "review_agent": expert.review_agent(),
+            "feedback_agent": expert.feedback_agent()
+        }
+        with self.lock:
+            self.stats["agent_sets"] += 1
+            self.stats["agent_seconds"] += time.perf_counter() - start
+        if self.reuse:
+            self.local.agents[model] = agents
+        return agents
+
+    def record_tier(self, model):
+        # counts the rules settled by each model of the cascade
+        with self.lock:
+            model_name = model or "default"
+            self.stats["tiers"][model_name] = self.stats["tiers"].get(model_name, 0) + 1
+
+    def tiers_summary(self):
+        return ", ".join(f"{count} by {model}" for model, count in self.stats["tiers"].items()) or "none"
+
+    def summary(self):
+        return (f"{self.stats['llm_clients']} LLM clients built in {self.stats['llm_seconds']:.2f}s, "
+                f"{self.stats['agent_sets']} agent sets built in {self.stats['agent_seconds']:.2f}s")
+
+    def close(self):
+        self.http_client.close()
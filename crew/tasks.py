@@ -1,6 +1,7 @@
+import re, hashlib, contextvars
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from textwrap import dedent
-from crewai import Task
 from pydantic import BaseModel, Field
 from typing import List, Optional, Literal, Tuple
 
@@ -9,15 +10,75 @@ class PRSchema:
     title: str
     body: str
     files_diff: List[Tuple[str, str]] = field(default_factory=list)
+    # (part number, number of parts) when files_diff is only one chunk of a large PR
+    part: Optional[Tuple[int, int]] = None
 
     def __str__(self):
         files_diff_str = ', '.join([f'({file[0]}, {file[1]})' for file in self.files_diff])
         return f"PRSchema(title={self.title}, body={self.body}, files_diff=[{files_diff_str}])"
 
+# PR context of the crews running in the current thread (or task), sent by the LLMs as the first message of every call
+CURRENT_PR_CONTEXT = contextvars.ContextVar("pr_context", default=None)
+# the tasks name the id of the PR context they were written for, so LLM calls missing it can be refused
+PR_CONTEXT_REFERENCE = "The PR to analyze is given in the PR context at the beginning of this conversation (context id {context_id})."
+PR_CONTEXT_ID_PATTERN = re.compile(r"\(context id ([0-9a-f]{12})\)")
+
+def build_pr_context(PR: PRSchema) -> str:
+    # byte-identical for every rule, task and agent seeing the same PR contents, so it's a cacheable prompt prefix
+    pr_context = "### PR context details:\n"
+    pr_context += f"**Title:** \"{PR.title}\"\n"
+    pr_context += f"**Body:** \"{PR.body}\"\n\n"
+    if PR.part:
+        pr_context += (f"**Note:** the PR is too large to review at once, these are the files of part {PR.part[0]} of {PR.part[1]}. "
+                       "The other parts are reviewed separately, so don't consider something missing from the PR only because it isn't in this part.\n\n")
+    pr_context += "### Files Affected: \n"
+    for file in PR.files_diff:
+        pr_context += f"**Filename:** {str(file[0])}\n"
+        pr_context += f"**Diff Content:**\n```{file[1]}```\n"
+    return pr_context
+
+@contextmanager
+def pr_context(PR: PRSchema):
+    # the crews kicked off within this block see the given PR
+    token = CURRENT_PR_CONTEXT.set(build_pr_context(PR))
+    try:
+        yield
+    finally:
+        CURRENT_PR_CONTEXT.reset(token)
+
+def get_pr_context():
+    return CURRENT_PR_CONTEXT.get()
+
+def get_pr_context_id(pr_context):
+    return hashlib.sha256(pr_context.encode('utf-8')).hexdigest()[:12]
+
+def verify_pr_context(prompts: List[str]):
+    # raises when the prompts come from Tasks but the current PR context is missing or belongs to another PR, ie. a crew
+    # kicked off outside pr_context(PR) or an LLM call made from another thread, which would judge the rule against no PR
+    context_ids = {context_id for prompt in prompts for context_id in PR_CONTEXT_ID_PATTERN.findall(prompt)}
+    if not context_ids:
+        return
+    pr_context = get_pr_context()
+    if pr_context is None:
+        error = "LLM call for a PR task without a PR context, kick the crew off within pr_context(PR)"
+    elif get_pr_context_id(pr_context) not in context_ids:
+        error = "LLM call for a PR task with the PR context of another PR"
+    else:
+        return
+    print(f"ERROR: {error}")
+    raise RuntimeError(error)
+
 # output schema definitions
 class RuleValidity(BaseModel):
     is_relevant: bool = Field(description="A boolean value indicating whether the rule has relation in regards to the given PR contents.")
 
+class RuleRelevance(BaseModel):
+    rule_number: int = Field(description="Number of the rule in the given list of rules.")
+    is_relevant: bool = Field(description="A boolean value indicating whether the rule has relation in regards to the given PR contents.")
+
+class RulesRelevance(BaseModel):
+    rules: List[RuleRelevance] = Field(description="Relevance of each of the given rules, one item per rule.")
+
 class Reasoning(BaseModel):
     section: Literal["title", "description", "file", "other"] = Field(description="Section of the PR that is not complying (title, description, file, or other)")
     file: Optional[str] = Field(description="Affected filename by rule, if applicable")
@@ -29,25 +90,28 @@ class RulesOutput(BaseModel):
     complies: bool = Field(description="True if the rule is correct, False if the rule is not being complied")
     score: int = Field(description="Score of the adherence to the rule, from 0 (bad) to 100 (perfect)")
     affected_sections: Optional[List[Reasoning]] = Field(description="If the PR doesn't adhere to the rule, indicates the affected sections and the reason for non-compliance regarding only the specified rule.")
+
+class RuleCompliance(RulesOutput):
+    rule_number: int = Field(description="Number of the rule in the given list of rules.")
+
+class RulesCompliance(BaseModel):
+    rules: List[RuleCompliance] = Field(description="Compliance assessment of each of the given rules, one item per rule.")
  
 # task definitions
+def new_task(**kwargs):
+    # crewai is only imported once the first crew is built, see crew.experts.new_agent
+    from crewai import Task
+    return Task(**kwargs)
+
 class Tasks():
+    # the PR itself isn't part of the tasks: kick their crews off within pr_context(PR), so it's sent as the prompt prefix
     def __init__(self, PR:PRSchema, rule:str):
         self.PR = PR
         self.rule = rule
-        self.pr_str = dedent(f"""\
-            ### PR context details:
-            **Title:** "{self.PR.title}"
-            **Body:** "{self.PR.body}"
-
-            ### Files Affected: 
-        """)
-        for file in self.PR.files_diff:
-            self.pr_str += f"**Filename:** {str(file[0])}\n"
-            self.pr_str += f"**Diff Content:**\n```{file[1]}```\n"
+        self.pr_str = PR_CONTEXT_REFERENCE.format(context_id=get_pr_context_id(build_pr_context(PR)))
 
     def is_rule_relevant(self, agent):
-        return Task(
+        return new_task(
             description=dedent(f"""\
                 {self.pr_str}
 
@@ -64,8 +128,27 @@ class Tasks():
             agent=agent
         )
 
+    def are_rules_relevant(self, agent, rules: List[str]):
+        rules_str = "\n".join([f'{index+1}. "{rule}"' for index, rule in enumerate(rules)])
+        return new_task(
+            description=dedent(f"""\
+                {self.pr_str}
+
+                ### Rules to be Evaluated:
+                {rules_str}
+
+                ### Question:
+                For each of the numbered rules above, is the rule relevant for analyzing the contents of this PR? Consider each rule's focus on the PR. We are not assessing whether the rules are satisfied, only if they are applicable to the PR provided.
+            """),
+            output_pydantic=RulesRelevance,
+            expected_output=dedent("""\
+                A list with one item per rule, with the rule number and a boolean value, true if the rule is relevant, false otherwise."""),
+            async_execution=False,
+            agent=agent
+        )
+
     def check_complaince(self, agent):
-        return Task(
+        return new_task(
             description=dedent(f"""\
                 {self.pr_str}
 
@@ -79,8 +162,27 @@ class Tasks():
             agent=agent
         )
     
+    def check_rules_complaince(self, agent, rules: List[str]):
+        rules_str = "\n".join([f'{index+1}. "{rule}"' for index, rule in enumerate(rules)])
+        return new_task(
+            description=dedent(f"""\
+                {self.pr_str}
+
+                # Check the PR for compliance with each of the following rules, independently of each other:
+                {rules_str}
+
+                # For each rule, only consider what the rule asks for, and give actionable feedback that a junior engineer can easily understand and apply, with an example fix or hint, for the rules that don't comply.
+            """),
+            output_pydantic=RulesCompliance,
+            expected_output=dedent("""\
+                A list with one item per rule, with the rule number, its compliance status (complies/does not comply), score and detailed assessment.
+            """),
+            async_execution=False,
+            agent=agent
+        )
+
     def verify_assessment(self, agent, compliance_result):
-        return Task(
+        return new_task(
             context=[compliance_result],
             description=dedent(f"""\
                 {self.pr_str}
@@ -95,7 +197,7 @@ class Tasks():
         )
 
     def generate_feedback(self, agent, verified_compliance):
-        return Task(
+        return new_task(
             context=[verified_compliance],
             description=dedent(f"""\
                 {self.pr_str}
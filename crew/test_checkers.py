@@ -0,0 +1,51 @@
+from crew.checkers import run_local_checkers, normalize_rule, get_added_lines, count_changed_lines
+from crew.tasks import PRSchema
+
+def make_pr(title="Add user lookup", body="Needed by the login page.", files_diff=None):
+    return PRSchema(title=title, body=body, files_diff=files_diff or [])
+
+def python_patch(*lines):
+    return f"@@ -0,0 +1,{len(lines)} @@\n" + "\n".join(f"+{line}" for line in lines)
+
+def test_normalize_rule():
+    assert normalize_rule("  The PR   title\ncan’t be empty. ") == "The PR title can't be empty"
+
+def test_not_empty_decides_plain_rules():
+    assert run_local_checkers(make_pr(), "The PR description cannot be empty.").complies
+    output = run_local_checkers(make_pr(body="  "), "The PR description cannot be empty.")
+    assert not output.complies and output.affected_sections[0].section == "description"
+    assert not run_local_checkers(make_pr(title=""), "The  PR title must not be empty").complies
+
+def test_compound_rules_are_left_to_the_crew():
+    pr = make_pr(files_diff=[("app.py", python_patch("user_name = 1"))])
+    assert run_local_checkers(pr, "The PR description cannot be empty and must explain why the change is needed.") is None
+    assert run_local_checkers(pr, "Variables must use snake_case and have descriptive names (no single letters).") is None
+    assert run_local_checkers(pr, "The code can't contain literal SQL statements unless reviewed by the DBA") is None
+
+def test_diff_size():
+    small = make_pr(files_diff=[("app.py", python_patch(*["x = 1"] * 10))])
+    large = make_pr(files_diff=[("app.py", python_patch(*["x = 1"] * 150)), ("README.md", python_patch(*["text"] * 150))])
+    assert run_local_checkers(small, "No code diff should be more than 100 lines").complies
+    output = run_local_checkers(large, "Diffs must not exceed 100 lines.")
+    assert not output.complies and [section.file for section in output.affected_sections] == ["app.py"]
+    # an affirmative limit means something else entirely
+    assert run_local_checkers(small, "Diffs must be more than 100 lines") is None
+
+def test_snake_case_variables():
+    rule = "All code variables must use snake_case convention"
+    assert run_local_checkers(make_pr(files_diff=[("app.py", python_patch("user_name = 1", "MAX_USERS = 2"))]), rule).complies
+    output = run_local_checkers(make_pr(files_diff=[("app.js", python_patch("const userName = 1;"))]), rule)
+    assert not output.complies and "`userName`" in output.affected_sections[0].why_is_not_complying
+    # languages the checker doesn't scan are left to the crew
+    assert run_local_checkers(make_pr(files_diff=[("main.go", python_patch("userName := 1"))]), rule) is None
+
+def test_literal_sql():
+    rule = "The code can't contain literal SQL statements"
+    output = run_local_checkers(make_pr(files_diff=[("db.py", python_patch("def f():", "    run('SELECT id FROM users')"))]), rule)
+    assert not output.complies and "line(s) 2" in output.affected_sections[0].why_is_not_complying
+    assert run_local_checkers(make_pr(files_diff=[("db.py", python_patch("x = 1"))]), "No raw SQL queries.").complies
+
+def test_get_added_lines_and_count_changed_lines():
+    patch = "--- a/app.py\n+++ b/app.py\n@@ -3,3 +3,3 @@\n a = 1\n-b = 2\n+b = 3\n c = 4\n\\ No newline at end of file"
+    assert get_added_lines(patch) == [(4, "b = 3")]
+    assert count_changed_lines(patch) == 2
@@ -0,0 +1,48 @@
+from crew.chunking import chunk_files_diff, merge_outputs, split_patch, estimate_file_tokens
+from crew.tasks import RulesOutput, Reasoning, PRSchema, build_pr_context
+
+def failing(score, filename):
+    return RulesOutput(complies=False, score=score, affected_sections=[
+        Reasoning(section="file", file=filename, why_is_not_complying="No tests.", what_should_be_changed=None)
+    ])
+
+def passing(score=100):
+    return RulesOutput(complies=True, score=score, affected_sections=None)
+
+def test_small_diffs_fit_in_one_chunk():
+    files_diff = [("a.py", "+a"), ("b.py", "+b")]
+    assert chunk_files_diff(files_diff, max_tokens=100) == [files_diff]
+    assert chunk_files_diff([], max_tokens=100) == [[]]
+
+def test_chunks_keep_the_files_order_under_the_budget():
+    files_diff = [(f"file_{number}.py", "+" + "x" * 200) for number in range(6)]
+    chunks = chunk_files_diff(files_diff, max_tokens=150)
+    assert [file for chunk in chunks for file in chunk] == files_diff
+    assert len(chunks) == 3
+    assert all(sum(estimate_file_tokens(file) for file in chunk) <= 150 for chunk in chunks)
+
+def test_large_files_are_split_on_hunks():
+    patch = "\n".join(f"@@ -{number},1 +{number},1 @@\n-old\n+{'y' * 100}" for number in range(1, 11))
+    chunks = chunk_files_diff([("big.py", patch)], max_tokens=100)
+    pieces = [piece for chunk in chunks for filename, piece in chunk]
+    assert len(chunks) > 1 and "".join(pieces) == patch
+    assert all(piece.startswith("@@ ") for piece in pieces)
+    assert "".join(split_patch(patch, 10)).replace("\n", "") == patch.replace("\n", "")
+
+def test_merge_requires_every_chunk_to_comply():
+    merged = merge_outputs([passing(90), failing(40, "a.py"), failing(20, "b.py"), failing(40, "a.py")])
+    assert not merged.complies and merged.score == 20
+    assert [section.file for section in merged.affected_sections] == ["a.py", "b.py"]
+    assert merge_outputs([passing(90), passing(70)]) == passing(70)
+
+def test_requirement_rules_comply_when_any_chunk_does():
+    merged = merge_outputs([failing(10, "app.py"), passing(85), passing(95)], requirement=True)
+    assert merged == passing(95)
+    merged = merge_outputs([failing(10, "app.py"), failing(30, "lib.py")], requirement=True)
+    assert not merged.complies and merged.score == 10 and len(merged.affected_sections) == 2
+
+def test_chunk_prompts_say_which_part_they_are():
+    PR = PRSchema(title="t", body="b", files_diff=[("a.py", "+a")])
+    assert "part" not in build_pr_context(PR)
+    PR.part = (2, 3)
+    assert "part 2 of 3" in build_pr_context(PR)
@@ -0,0 +1,61 @@
+import time
+from pr_rules_check import CommentUpdater
+
+class FakeComment():
+    def __init__(self, body, fail=False):
+        self.bodies = [body]
+        self.fail = fail
+
+    def edit(self, body):
+        if self.fail:
+            raise RuntimeError("comment deleted")
+        self.bodies.append(body)
+
+class FakePR():
+    def __init__(self):
+        self.comments = []
+
+    def create_issue_comment(self, body):
+        self.comments.append(FakeComment(body))
+        return self.comments[-1]
+
+def written_bodies(pr):
+    return [body for comment in pr.comments for body in comment.bodies]
+
+def test_updates_within_the_interval_are_written_together():
+    pr = FakePR()
+    updater = CommentUpdater(pr, interval=0.2)
+    updater.update("rule 1")
+    updater.update("rules 1-2")
+    updater.update("rules 1-3")
+    # the first update is written right away, the others wait for the interval and only the latest is written
+    assert written_bodies(pr) == ["rule 1"]
+    time.sleep(0.4)
+    assert written_bodies(pr) == ["rule 1", "rules 1-3"]
+    assert len(pr.comments) == 1 and updater.writes == 2
+
+def test_forced_updates_are_written_right_away():
+    pr = FakePR()
+    updater = CommentUpdater(pr, interval=60)
+    updater.update("rule 1")
+    updater.update("rules 1-2")
+    updater.update("final", force=True)
+    assert written_bodies(pr) == ["rule 1", "final"]
+    assert updater.timer is None
+
+def test_unchanged_bodies_are_not_written_again():
+    pr = FakePR()
+    updater = CommentUpdater(pr, interval=0)
+    updater.update("results")
+    updater.update("results", force=True)
+    assert updater.writes == 1
+
+def test_existing_comment_is_edited_or_replaced_when_gone():
+    pr = FakePR()
+    comment = FakeComment("previous run")
+    CommentUpdater(pr, comment, interval=0).update("this run")
+    assert comment.bodies == ["previous run", "this run"] and pr.comments == []
+    deleted = FakeComment("previous run", fail=True)
+    updater = CommentUpdater(pr, deleted, interval=0)
+    updater.update("this run")
+    assert written_bodies(pr) == ["this run"] and updater.comment is pr.comments[0]
@@ -0,0 +1,36 @@
+from crew.compaction import compact_patch, compact_files_diff, get_omitted_reason, format_hunk_header
+
+def test_context_lines_are_trimmed():
+    patch = "@@ -1,7 +1,7 @@\n a\n b\n c\n-d\n+D\n e\n f\n g"
+    assert compact_patch(patch, context_lines=1) == "@@ -3,3 +3,3 @@\n c\n-d\n+D\n e"
+
+def test_reindentation_is_kept_for_indentation_sensitive_files():
+    patch = "@@ -1,2 +1,2 @@\n if ready:\n-    run()\n+run()"
+    compacted, _ = compact_files_diff([("app.py", patch), ("app.js", patch)])
+    assert "+run()" in compacted[0][1]
+    assert compacted[1][1] == "\\ diff omitted: whitespace-only changes"
+
+def test_deletions_only_hunks_are_summarized():
+    patch = "@@ -1,200 +0,0 @@\n" + "\n".join(f"-line {number}" for number in range(200))
+    assert compact_patch(patch) == "@@ -1,200 +0,0 @@\n\\ 200 lines removed"
+
+def test_format_hunk_header_at_start_of_file():
+    assert format_hunk_header(0, 0, 1, 3) == "@@ -0,0 +1,3 @@"
+    assert format_hunk_header(5, 0, 5, 2) == "@@ -4,0 +5,2 @@"
+
+def test_omitted_reasons():
+    assert get_omitted_reason("web/package-lock.json", "+{}") == "lockfile"
+    assert get_omitted_reason("vendor/lib/a.go", "+x") == "vendored file"
+    assert get_omitted_reason("api/users.pb.go", "+x") == "generated file"
+    assert get_omitted_reason("api/users.go", "@@ -0,0 +1,2 @@\n+// Code generated by protoc. DO NOT EDIT.\n+package api") == "generated file"
+    assert get_omitted_reason("app.js", "+" + "x" * 400) == "minified file"
+
+def test_generated_marker_only_counts_at_the_top_of_new_files():
+    patch = "@@ -10,2 +10,3 @@\n a = 1\n+# TODO: autogenerated ids should be validated\n b = 2"
+    assert get_omitted_reason("app.py", patch) is None
+
+def test_compaction_stats():
+    patch = "@@ -1,41 +1,41 @@\n" + "\n".join(f" unchanged line {number}" for number in range(40)) + "\n-old\n+new"
+    compacted, stats = compact_files_diff([("app.py", patch), ("yarn.lock", "+a\n+b")])
+    assert compacted[1] == ("yarn.lock", "\\ diff omitted: lockfile, 2 lines changed")
+    assert stats["files"] == 2 and stats["saved_bytes"] == stats["original_bytes"] - stats["compacted_bytes"] > 0
@@ -0,0 +1,85 @@
+import time, threading
+import pytest
+import pr_rules_check
+from pr_rules_check import CheckListItem, PRSchema, RulesOutput, evaluate_rules
+
+PR = PRSchema(title="Add users", body="Stores the users.", files_diff=[("app/users.py", "+a")])
+PASSED = RulesOutput(complies=True, score=100, affected_sections=None)
+FAILED = RulesOutput(complies=False, score=0, affected_sections=None)
+
+class FakeValidator():
+    # stands for the crew: each rule takes its given seconds and returns its given verdict, unless it's cancelled first
+    def __init__(self, seconds=None, verdicts=None):
+        self.seconds = seconds or {}
+        self.verdicts = verdicts or {}
+        self.calls = []
+        self.cancelled = []
+        self.lock = threading.Lock()
+
+    def __call__(self, pr_schema, rule, cancel_event=None, session=None, is_relevant=None):
+        with self.lock:
+            self.calls.append(rule)
+        if cancel_event is not None and cancel_event.wait(self.seconds.get(rule, 0)):
+            with self.lock:
+                self.cancelled.append(rule)
+            return None
+        return self.verdicts.get(rule, PASSED)
+
+@pytest.fixture
+def validator(monkeypatch):
+    def install(**kwargs):
+        fake = FakeValidator(**kwargs)
+        monkeypatch.setattr(pr_rules_check, "validate_rule", fake)
+        return fake
+    return install
+
+def make_rules(*types):
+    return [CheckListItem(text=f"rule {index}", type=rule_type) for index, rule_type in enumerate(types)]
+
+def run(rules, **kwargs):
+    return [(rule.text, output) for rule, output in evaluate_rules({rule.text: PR for rule in rules}, rules, **kwargs)]
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_results_are_yielded_in_file_order(validator, max_workers):
+    rules = make_rules("mandatory", "warning", "mandatory", "warning")
+    # the last rules finish first
+    validator(seconds={"rule 0": 0.15, "rule 1": 0.1, "rule 2": 0.05})
+    assert run(rules, max_workers=max_workers) == [(rule.text, PASSED) for rule in rules]
+
+def test_failing_warnings_dont_stop_the_evaluation(validator):
+    rules = make_rules("warning", "mandatory")
+    validator(verdicts={"rule 0": FAILED})
+    assert run(rules, max_workers=2) == [("rule 0", FAILED), ("rule 1", PASSED)]
+
+def test_sequential_evaluation_stops_at_the_first_failing_mandatory_rule(validator):
+    rules = make_rules("mandatory", "mandatory", "mandatory")
+    fake = validator(verdicts={"rule 1": FAILED})
+    assert run(rules, max_workers=1) == [("rule 0", PASSED), ("rule 1", FAILED)]
+    assert fake.calls == ["rule 0", "rule 1"]
+
+def test_concurrent_evaluation_cancels_the_rules_after_a_failure(validator):
+    rules = make_rules("mandatory", "mandatory", "warning", "warning", "warning")
+    fake = validator(seconds={"rule 2": 5, "rule 3": 5, "rule 4": 5}, verdicts={"rule 1": FAILED})
+    start = time.monotonic()
+    assert run(rules, max_workers=3) == [("rule 0", PASSED), ("rule 1", FAILED)]
+    # the rules after it that already started were told to stop, instead of running to the end
+    assert time.monotonic() - start < 2
+    started_after = sorted(rule for rule in fake.calls if rule not in ("rule 0", "rule 1"))
+    for _ in range(100):
+        if len(fake.cancelled) == len(started_after):
+            break
+        time.sleep(0.01)
+    assert "rule 2" in started_after and sorted(fake.cancelled) == started_after
+
+def test_evaluation_order_keeps_the_file_order_results(validator):
+    rules = make_rules("mandatory", "warning", "mandatory", "warning")
+    fake = validator(verdicts={"rule 2": FAILED})
+    # rule 2 is checked first, so rule 3 after it is never checked, but rules 0 and 1 before it still are
+    assert run(rules, max_workers=1, order=[2, 0, 1, 3]) == [("rule 0", PASSED), ("rule 1", PASSED), ("rule 2", FAILED)]
+    assert fake.calls == ["rule 2", "rule 0", "rule 1"]
+
+def test_known_verdicts_skip_the_crew(validator):
+    rules = make_rules("mandatory", "warning")
+    fake = validator()
+    assert run(rules, known_verdicts={"rule 0": FAILED}) == [("rule 0", FAILED)]
+    assert fake.calls == []
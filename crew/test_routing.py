@@ -0,0 +1,40 @@
+from crew.routing import FileIndex, route_rule, infer_scope, parse_scope, get_category
+from crew.tasks import PRSchema
+
+FILES_DIFF = [
+    ("app/users.py", "+import sqlite3"),
+    ("web/login.ts", "+const a = 1;"),
+    ("docs/guide.md", "+Some text"),
+    ("migrations/0001.sql", "+CREATE TABLE users (id int);"),
+    ("package-lock.json", "+{}"),
+]
+PR = PRSchema(title="Add users", body="Stores the users.", files_diff=FILES_DIFF)
+
+def routed_files(rule, scope=None):
+    schema = route_rule(FileIndex(FILES_DIFF), PR, rule, scope)
+    return None if schema is None else [filename for filename, _ in schema.files_diff]
+
+def test_categories():
+    assert [get_category(filename) for filename, _ in FILES_DIFF] == ['code', 'code', 'docs', 'code', 'lockfile']
+
+def test_parse_scope():
+    assert parse_scope(" python, migrations/*.sql ,") == ['python', 'migrations/*.sql']
+    assert parse_scope("") is None
+
+def test_inferred_scopes():
+    assert infer_scope("Python functions should use type hints") == ['python']
+    assert infer_scope("Variables must use snake_case") == ['code']
+    assert infer_scope("The PR title cannot be empty") == ['pr']
+    # requirements need to see every file
+    assert infer_scope("Code changes must include tests") == ['all']
+    assert infer_scope("Be nice") == ['all']
+
+def test_route_rule():
+    assert routed_files("Python functions should use type hints") == ["app/users.py"]
+    assert routed_files("Variables must use snake_case") == ["app/users.py", "web/login.ts", "migrations/0001.sql"]
+    assert routed_files("The PR title cannot be empty") == []
+    assert routed_files("Any rule", ['migrations/*.sql', 'contains:sqlite3']) == ["app/users.py", "migrations/0001.sql"]
+    assert routed_files("Any rule", ['*.md']) == ["docs/guide.md"]
+
+def test_rules_without_files_in_scope_are_skipped():
+    assert routed_files("Ruby methods must be short", ['ruby']) is None
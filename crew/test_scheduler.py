@@ -0,0 +1,100 @@
+import httpx
+import pytest
+from crew.scheduler import Scheduler, ScheduledTransport, TokenBucket, get_retry_after
+
+class RateLimited(Exception):
+    status_code = 429
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited")
+        self.headers = {"Retry-After": retry_after} if retry_after is not None else {}
+
+def make_scheduler(**kwargs):
+    # records the waits instead of sleeping
+    scheduler = Scheduler("test", base_delay=0.01, **kwargs)
+    scheduler.waits = []
+    scheduler.wait = lambda seconds: scheduler.waits.append(seconds) if seconds > 0 else None
+    return scheduler
+
+def flaky(*errors, result="ok"):
+    # raises the given errors on the first calls, then returns result
+    calls = []
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    fn.calls = calls
+    return fn
+
+def test_call_retries_following_retry_after():
+    scheduler = make_scheduler()
+    fn = flaky(RateLimited("2"))
+    assert scheduler.call(fn) == "ok"
+    assert len(fn.calls) == 2 and scheduler.stats["retries"] == 1
+    assert 2 <= scheduler.waits[0] <= 2.01
+    # the other callers are paused too
+    assert scheduler.paused_until > 0
+
+def test_call_backs_off_exponentially_without_retry_after():
+    scheduler = make_scheduler(max_retries=3)
+    fn = flaky(RateLimited(), RateLimited(), RateLimited(), RateLimited())
+    with pytest.raises(RateLimited):
+        scheduler.call(fn)
+    assert len(fn.calls) == 4 and len(scheduler.waits) == 3
+    assert scheduler.waits[0] <= 0.01 and scheduler.waits[2] <= 0.04
+
+def test_call_doesnt_retry_other_errors_or_long_waits():
+    scheduler = make_scheduler(max_delay=60)
+    fn = flaky(ValueError("bad request"))
+    with pytest.raises(ValueError):
+        scheduler.call(fn)
+    fn = flaky(RateLimited("3600"))
+    with pytest.raises(RateLimited):
+        scheduler.call(fn)
+    assert len(fn.calls) == 1 and scheduler.waits == []
+
+def test_token_bucket_asks_to_wait_once_empty():
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0
+    assert 0.9 < bucket.reserve(1) <= 1.0
+
+def test_retry_after_headers():
+    assert get_retry_after({"Retry-After": "5"}) == 5
+    assert get_retry_after({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "1m30s"}) == 90
+    assert get_retry_after({"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "20ms"}) == 0.02
+    assert get_retry_after({"x-ratelimit-remaining-requests": "10"}) is None
+
+def make_client(scheduler, *responses):
+    # responses are status codes, (status code, headers) or exceptions, answered in order
+    requests = []
+    def handler(request):
+        requests.append(request)
+        answer = responses[min(len(requests), len(responses)) - 1]
+        if isinstance(answer, Exception):
+            raise answer
+        status, headers = answer if isinstance(answer, tuple) else (answer, {})
+        return httpx.Response(status, headers=headers, json={})
+    client = httpx.Client(transport=ScheduledTransport(scheduler, httpx.MockTransport(handler)))
+    return client, requests
+
+def test_transport_retries_rate_limited_requests():
+    scheduler = make_scheduler()
+    client, requests = make_client(scheduler, (429, {"Retry-After": "1"}), 200)
+    assert client.post("https://api.test/v1/chat", json={"prompt": "x" * 400}).status_code == 200
+    assert len(requests) == 2 and 1 <= scheduler.waits[0] <= 1.01
+    assert scheduler.stats["calls"] == 2
+
+def test_transport_retries_connection_errors():
+    scheduler = make_scheduler()
+    client, requests = make_client(scheduler, httpx.ConnectError("refused"), 200)
+    assert client.get("https://api.test/v1/models").status_code == 200
+    assert len(requests) == 2
+
+def test_transport_returns_the_last_answer_once_out_of_retries():
+    scheduler = make_scheduler(max_retries=2)
+    client, requests = make_client(scheduler, 503)
+    assert client.get("https://api.test/v1/models").status_code == 503
+    assert len(requests) == 3
+    client, requests = make_client(scheduler, 400)
+    assert client.get("https://api.test/v1/models").status_code == 400
+    assert len(requests) == 1
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+import pytest
+from pr_rules_check import (CheckListItem, PRSchema, RulesOutput, build_state_marker, fit_state_marker, read_previous_state,
+                            get_carried_verdicts, hash_text, hash_files, hash_pr_text, get_model_name, COMMENT_MARKER)
+
+OWN_LOGIN = "github-actions[bot]"
+PR = PRSchema(title="Add users", body="Stores the users.", files_diff=[("app/users.py", "+a"), ("docs/users.md", "+b")])
+RULES = [CheckListItem(text="Python code must be typed", type="mandatory"), CheckListItem(text="Docs must be in english", type="optional")]
+RULE_SCHEMAS = {
+    RULES[0].text: PRSchema(PR.title, PR.body, [PR.files_diff[0]]),
+    RULES[1].text: PRSchema(PR.title, PR.body, [PR.files_diff[1]]),
+}
+PASSED = RulesOutput(complies=True, score=95, affected_sections=None)
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    monkeypatch.delenv("STATE_SECRET", raising=False)
+    monkeypatch.delenv("CASCADE_MODELS", raising=False)
+    monkeypatch.setenv("LLM_TYPE", "openai")
+
+def make_state(**overrides):
+    state = {
+        "head_sha": "a" * 40,
+        "model": get_model_name(),
+        "text_hash": hash_pr_text(PR),
+        "rules": {hash_text(rule.text): {
+            "files_hash": hash_files([filename for filename, _ in RULE_SCHEMAS[rule.text].files_diff]),
+            "verdict": PASSED.model_dump(mode="json")
+        } for rule in RULES}
+    }
+    state.update(overrides)
+    return state
+
+def make_comment(state, login=OWN_LOGIN):
+    return SimpleNamespace(body=f"{COMMENT_MARKER}\nresults\n{build_state_marker(state)}", user=SimpleNamespace(login=login))
+
+def make_repo(status="ahead", changed=()):
+    comparison = SimpleNamespace(status=status, files=[SimpleNamespace(filename=filename, previous_filename=None) for filename in changed])
+    return SimpleNamespace(compare=lambda base, head: comparison)
+
+def test_state_round_trip():
+    state = make_state()
+    assert read_previous_state(make_comment(state), OWN_LOGIN) == state
+    # anyone can comment on the PR, their states are never trusted
+    assert read_previous_state(make_comment(state, login="attacker"), OWN_LOGIN) is None
+
+def test_signed_state(monkeypatch):
+    monkeypatch.setenv("STATE_SECRET", "secret")
+    state = make_state()
+    comment = make_comment(state)
+    assert read_previous_state(comment, OWN_LOGIN) == state
+    comment.body = comment.body.replace('"score":95', '"score":99')
+    assert read_previous_state(comment, OWN_LOGIN) is None
+    monkeypatch.delenv("STATE_SECRET")
+    signed_comment = make_comment(state)
+    monkeypatch.setenv("STATE_SECRET", "secret")
+    assert read_previous_state(signed_comment, OWN_LOGIN) is None
+
+def test_state_marker_is_fitted_by_dropping_verdicts():
+    state = make_state()
+    full_length = len(build_state_marker(state))
+    fitted = fit_state_marker(state, full_length - 1)
+    assert fitted is not None and len(fitted) < full_length
+    assert fit_state_marker(state, 10) is None
+
+def test_carried_verdicts_skip_rules_whose_files_changed():
+    carried = get_carried_verdicts(make_repo(changed=["docs/users.md"]), make_state(), PR, RULES, RULE_SCHEMAS, "b" * 40)
+    assert carried == {RULES[0].text: PASSED}
+
+def test_nothing_is_carried_when_the_changes_are_unknown():
+    assert get_carried_verdicts(make_repo(status="diverged"), make_state(), PR, RULES, RULE_SCHEMAS, "b" * 40) == {}
+    assert get_carried_verdicts(make_repo(), make_state(text_hash="other"), PR, RULES, RULE_SCHEMAS, "b" * 40) == {}
+    assert get_carried_verdicts(make_repo(), make_state(model="other"), PR, RULES, RULE_SCHEMAS, "b" * 40) == {}
+
+def test_malformed_states_recheck_every_rule():
+    states = [
+        {key: value for key, value in make_state().items() if key != "rules"},
+        {key: value for key, value in make_state().items() if key != "head_sha"},
+        make_state(rules=["not", "a", "dict"]),
+        make_state(rules={key: {**previous, "verdict": {"score": "high"}} for key, previous in make_state()["rules"].items()}),
+    ]
+    for state in states:
+        assert get_carried_verdicts(make_repo(), state, PR, RULES, RULE_SCHEMAS, "b" * 40) == {}
+    comment = make_comment(make_state())
+    comment.body = f"{COMMENT_MARKER}\n<!-- pr-rules-state [1, 2] -->"
+    assert read_previous_state(comment, OWN_LOGIN) is None
@@ -0,0 +1,32 @@
+import pytest
+from crew.tasks import PRSchema, Tasks, pr_context, get_pr_context, verify_pr_context, build_pr_context
+
+PR = PRSchema(title="Add users", body="Stores the users.", files_diff=[("app/users.py", "+import sqlite3")])
+OTHER_PR = PRSchema(title="Fix typo", body="", files_diff=[("README.md", "+typo")])
+
+def test_pr_context_is_set_within_the_block():
+    assert get_pr_context() is None
+    with pr_context(PR):
+        assert get_pr_context() == build_pr_context(PR)
+        assert "app/users.py" in get_pr_context()
+    assert get_pr_context() is None
+
+def test_pr_context_is_the_same_for_every_rule():
+    # the prefix must be byte-identical for the LLM provider to serve it from its prompt cache
+    assert build_pr_context(PR) == build_pr_context(PRSchema(PR.title, PR.body, list(PR.files_diff)))
+    assert Tasks(PR, "rule A").pr_str == Tasks(PR, "rule B").pr_str
+    assert Tasks(PR, "rule A").pr_str != Tasks(OTHER_PR, "rule A").pr_str
+
+def test_task_prompts_require_their_pr_context():
+    prompt = Tasks(PR, "rule").pr_str
+    with pytest.raises(RuntimeError, match="without a PR context"):
+        verify_pr_context(["You are an expert.", prompt])
+    with pr_context(OTHER_PR), pytest.raises(RuntimeError, match="another PR"):
+        verify_pr_context([prompt])
+    with pr_context(PR):
+        verify_pr_context([prompt])
+
+def test_prompts_not_from_tasks_are_left_alone():
+    verify_pr_context(["Summarize this text."])
+    with pr_context(PR):
+        verify_pr_context(["Summarize this text."])
@@ -1,19 +1,29 @@
 #!/bin/sh
 
-GITHUB_TOKEN=$1
-FILE_PATH=$2
-OPENAI_API_KEY=$3
+SCRIPT=/pr_rules_check.py
+if [ "$1" = "serve" ]; then
+  # long-running service checking many PRs (see pr_rules_server.py), configured through environment variables
+  SCRIPT=/pr_rules_server.py
+  shift
+else
+  GITHUB_TOKEN=$1
+  FILE_PATH=$2
+  OPENAI_API_KEY=$3
+fi
 export PYTHONUNBUFFERED=1 # this is to make sure that the output is not buffered and is printed in real-time
 
 if [ -z "$OPENAI_API_KEY" ]; then
   # export args as ENV variables
   export GITHUB_TOKEN=$GITHUB_TOKEN
   export FILE_PATH=$FILE_PATH  
-  echo "OpenAI API key not provided. Starting Ollama using Shell..."
+  echo "OpenAI API key not provided. Installing Ollama using Shell..."
+  export OLLAMA_DIR=${OLLAMA_DIR:-/opt/ollama}
   /bin/sh -c /install_ollama.sh
+  [ -d "$OLLAMA_DIR" ] && export OLLAMA_DIR="$(cd "$OLLAMA_DIR" && pwd)"
+  export PATH="$OLLAMA_DIR/bin:$PATH"
 else
   echo "OpenAI API key provided. Skipping Ollama installation."
 fi
 
 echo "Running the script... $@"
-python -u /pr_rules_check.py "$@"
+python -u $SCRIPT "$@"
@@ -1,10 +1,15 @@
 #!/bin/sh
-echo "OpenAI API key not provided. Installing Ollama..."
-curl -fsSL https://ollama.com/install.sh | sh
-sleep 10
-echo "Starting Ollama server in background thread..."
-ollama serve > /dev/null 2>&1 &
-sleep 10
-echo "Downloading Ollama model... 4.1 GB"
-ollama pull "phi3:3.8b-mini-128k-instruct-q8_0" > /dev/null 2>&1
-sleep 10
\ No newline at end of file
+# Installs Ollama into OLLAMA_DIR, reusing it when it's already there (ie. restored by actions/cache);
+# the server, model downloads and warm-up are handled by crew/ollama.py, which keeps models in OLLAMA_DIR/models
+OLLAMA_DIR=${OLLAMA_DIR:-/opt/ollama}
+if command -v ollama > /dev/null 2>&1 || [ -x "$OLLAMA_DIR/bin/ollama" ]; then
+  echo "Ollama already installed, skipping download."
+  exit 0
+fi
+case "$(uname -m)" in
+  aarch64|arm64) OLLAMA_ARCH=arm64 ;;
+  *) OLLAMA_ARCH=amd64 ;;
+esac
+echo "Installing Ollama into $OLLAMA_DIR..."
+mkdir -p "$OLLAMA_DIR"
+curl -fsSL "https://ollama.com/download/ollama-linux-$OLLAMA_ARCH.tgz" | tar -xz -C "$OLLAMA_DIR"
@@ -1,16 +1,35 @@
-import os, sys, re
+import os, sys, re, json, hmac, time, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from github import Github
-from crew.rule_validation import validate_rule, PRSchema
+from crew.rule_validation import validate_rule, validate_rules_batch, triage_rules, PRSchema, RulesOutput
+from crew.chunking import group_rules, estimate_tokens, estimate_file_tokens
+from crew.rule_stats import RuleStats
+from crew.experts import get_model_name, get_model_tiers, OLLAMA_MODEL
+from crew.ollama import get_ollama_manager
+from crew.cache import VerdictCache
+from crew.checkers import run_local_checkers, load_checkers_file
+from crew.routing import FileIndex, route_rule, parse_scope
+from crew.compaction import compact_files_diff
+from crew.session import CrewSession
+from crew.metrics import Metrics
+from crew.scheduler import get_scheduler
+from contextlib import nullcontext
 from dataclasses import dataclass, field
+from typing import Optional, List
 
 @dataclass
 class CheckListItem:
     text: str
     type: str
+    scope: Optional[List[str]] = None
+
+def github_call(fn, *args, **kwargs):
+    # every GitHub API call goes through the shared rate limits, retrying rate limited and transient failures
+    return get_scheduler("github").call(fn, *args, **kwargs)
 
 def read_markdown_file(repo, branch, file_path):
     try:
-        file_content = repo.get_contents(file_path, ref=branch)
+        file_content = github_call(repo.get_contents, file_path, ref=branch)
         return file_content.decoded_content.decode('utf-8')
     except Exception as e:
         print(f"Error reading markdown file: {e}")
@@ -19,15 +38,19 @@ def read_markdown_file(repo, branch, file_path):
 def parse_checklist_items(content) -> list[CheckListItem]:
     # Update the regex pattern to match both '- [x] ' and '- [ ] ' at the beginning of each line
     checklist_pattern = re.compile(r'- \[([ xX])\] (.*)')
+    # optional hidden annotation limiting the files a rule applies to, ie. '<!-- scope: python, migrations/*.sql -->'
+    scope_pattern = re.compile(r'<!--\s*scope:(.*?)-->', re.IGNORECASE)
     checklist_items = []
 
     for line in content.split('\n'):
         match = checklist_pattern.match(line)
         if match:
             status, item = match.groups()
+            scope_match = scope_pattern.search(item)
             item_data = CheckListItem(
-                text=item.strip(),
-                type='mandatory' if status.lower() == 'x' else 'warning'
+                text=scope_pattern.sub('', item).strip(),
+                type='mandatory' if status.lower() == 'x' else 'warning',
+                scope=parse_scope(scope_match.group(1)) if scope_match else None
             )
             checklist_items.append(item_data)
 
@@ -36,7 +59,7 @@ def parse_checklist_items(content) -> list[CheckListItem]:
 def get_diff(repo, base_branch, compare_branch):
     # return as a list of tuples
     try:
-        comparison = repo.compare(base_branch, compare_branch)
+        comparison = github_call(repo.compare, base_branch, compare_branch)
         diffs = []
         for file in comparison.files:
             if file.patch:
@@ -48,12 +71,281 @@ def get_diff(repo, base_branch, compare_branch):
         print(f"Error getting diff: {e}")
         return None
 
-def post_comment(pr, comment_body):
+def open_local_repo():
+    # returns the git checkout of the workspace, or None when there isn't one (or gitpython isn't installed)
     try:
-        pr.create_issue_comment(body=comment_body)
+        import git
+        # the workspace is owned by another user inside the action container
+        os.environ.setdefault("GIT_CONFIG_COUNT", "1")
+        os.environ.setdefault("GIT_CONFIG_KEY_0", "safe.directory")
+        os.environ.setdefault("GIT_CONFIG_VALUE_0", "*")
+        return git.Repo(os.getenv('GITHUB_WORKSPACE') or '.', search_parent_directories=True)
+    except Exception as e:
+        print(f"Local checkout not available: {e}")
+        return None
+
+def ensure_local_commits(local_repo, shas, depth):
+    # fetches the given commits when the checkout doesn't have them (ie. shallow clones)
+    missing = []
+    for sha in shas:
+        try:
+            local_repo.commit(sha)
+        except Exception:
+            missing.append(sha)
+    if missing:
+        print(f"Fetching {len(missing)} missing commits into the local checkout...")
+        local_repo.git.fetch('--no-tags', '--quiet', f'--depth={depth}', 'origin', *missing)
+
+def read_local_markdown_file(local_repo, base_sha, file_path):
+    # reads the rules file as of the base commit, so the PR itself can't change the rules it's checked against
+    try:
+        ensure_local_commits(local_repo, [base_sha], 1)
+        return local_repo.git.show(f"{base_sha}:{os.path.normpath(file_path)}")
+    except Exception as e:
+        print(f"Error reading markdown file from the local checkout: {e}")
+        return None
+
+def get_local_diff(local_repo, base_sha, head_sha, depth=50):
+    # same (filename, patch) tuples as get_diff, computed from the local checkout against the merge base
+    try:
+        ensure_local_commits(local_repo, [base_sha, head_sha], depth)
+        merge_bases = local_repo.merge_base(base_sha, head_sha)
+        if not merge_bases:
+            print("No merge base found in the local checkout (use 'fetch-depth: 0' with actions/checkout)")
+            return None
+        diffs = []
+        for file in merge_bases[0].diff(head_sha, create_patch=True, M=True):
+            patch = file.diff.decode('utf-8', errors='replace') if isinstance(file.diff, bytes) else file.diff
+            if patch:
+                diffs.append((file.b_path or file.a_path, patch.rstrip('\n')))
+        return diffs
+    except Exception as e:
+        print(f"Error getting diff from the local checkout: {e}")
+        return None
+
+def post_comment(pr, comment_body, comment=None):
+    # edits our existing comment when given, otherwise (or if it's gone) posts a new one; returns the comment
+    if comment is not None:
+        try:
+            github_call(comment.edit, body=comment_body)
+            print("Comment updated on the PR.")
+            return comment
+        except Exception as e:
+            print(f"Error updating comment, posting a new one: {e}")
+    try:
+        comment = github_call(pr.create_issue_comment, body=comment_body)
         print("Comment posted on the PR.")
+        return comment
     except Exception as e:
         print(f"Error posting comment: {e}")
+        return None
+
+class CommentUpdater():
+    # keeps our PR comment up to date while the rules are evaluated, writing it at most once every interval seconds;
+    # throttled updates are written when the interval is over, so the latest verdicts always show up
+    def __init__(self, pr, comment=None, interval=5, metrics=None):
+        self.pr = pr
+        self.comment = comment
+        self.interval = interval
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.body = None # last written body
+        self.pending_body = None
+        self.last_write = 0.0
+        self.timer = None
+        self.writes = 0
+
+    def update(self, body, force=False):
+        with self.lock:
+            self.pending_body = body
+            wait = self.last_write + self.interval - time.monotonic()
+            if force or wait <= 0:
+                self._write()
+            elif self.timer is None:
+                self.timer = threading.Timer(wait, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self._write()
+
+    def _write(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        body, self.pending_body = self.pending_body, None
+        if body is None or body == self.body:
+            return
+        with self.metrics.stage("comment_post") if self.metrics else nullcontext():
+            comment = post_comment(self.pr, body, self.comment)
+        if comment is not None:
+            self.comment = comment
+            self.body = body
+            self.writes += 1
+        self.last_write = time.monotonic()
+
+# hidden marker identifying our PR comment, which is edited by every run instead of posting new ones
+COMMENT_MARKER = "<!-- pr-rules -->"
+# hidden marker in our PR comment holding the head SHA and verdicts of the last run
+STATE_MARKER_PATTERN = re.compile(r'<!-- pr-rules-state (.*?) -->', re.DOTALL)
+# GitHub refuses comments longer than this
+MAX_COMMENT_LENGTH = 65536
+# author of the comments posted with the workflow's GITHUB_TOKEN, which can't read its own user
+ACTIONS_BOT_LOGIN = "github-actions[bot]"
+
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+def hash_pr_text(pr_schema):
+    return hash_text(f"{pr_schema.title}\n{pr_schema.body}")
+
+def get_rule_files(rule_schema):
+    # filenames whose diff is sent to the crew when validating the rule
+    if rule_schema is None:
+        return []
+    return [file[0] for file in rule_schema.files_diff]
+
+def hash_files(files):
+    # the state keeps a hash of each rule's files instead of the list, which could make the comment too long
+    return hash_text("\n".join(sorted(files)))
+
+def route_rules(pr_schema, checklist_items):
+    # returns {rule text: PRSchema with only the files in the rule's scope, or None if there are none}
+    index = FileIndex(pr_schema.files_diff)
+    rule_schemas = {}
+    for rule in checklist_items:
+        rule_schemas[rule.text] = route_rule(index, pr_schema, rule.text, rule.scope)
+        routed_files = get_rule_files(rule_schemas[rule.text])
+        print(f"Rule routed to {len(routed_files)}/{len(pr_schema.files_diff)} files: {rule.text}")
+    return rule_schemas
+
+def sign_state(state):
+    # HMAC of the state with STATE_SECRET, or None when it isn't set
+    secret = os.getenv('STATE_SECRET')
+    if not secret:
+        return None
+    payload = json.dumps(state, sort_keys=True, separators=(',', ':'))
+    return hmac.new(secret.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def build_state_marker(state):
+    signature = sign_state(state)
+    if signature:
+        state = {**state, "signature": signature}
+    # '--' can only appear inside JSON strings, so escaping it keeps the HTML comment from being closed early
+    state_json = json.dumps(state, separators=(',', ':')).replace('--', '\\u002d\\u002d')
+    return f"<!-- pr-rules-state {state_json} -->"
+
+def fit_state_marker(state, max_length):
+    # drops the biggest verdicts from the state until its marker fits in max_length, None if it never does
+    rules = dict(state.get("rules") or {})
+    state_marker = build_state_marker(state)
+    while len(state_marker) > max_length and rules:
+        del rules[max(rules, key=lambda key: len(json.dumps(rules[key])))]
+        state_marker = build_state_marker({**state, "rules": rules})
+    return state_marker if len(state_marker) <= max_length else None
+
+def get_own_login(github):
+    # login of the identity behind the token, ie. a personal access token's user
+    try:
+        return github_call(lambda: github.get_user().login)
+    except Exception:
+        return ACTIONS_BOT_LOGIN
+
+def is_own_comment(comment, own_login):
+    user = getattr(comment, "user", None)
+    return user is not None and user.login == own_login
+
+def find_own_comment(pr, own_login):
+    # returns the most recent comment we posted on the PR, or None; comments quoting ours are written by someone else
+    try:
+        for comment in reversed(github_call(lambda: list(pr.get_issue_comments()))):
+            body = comment.body or ""
+            if not is_own_comment(comment, own_login):
+                continue
+            if COMMENT_MARKER in body or STATE_MARKER_PATTERN.search(body):
+                return comment
+    except Exception as e:
+        print(f"Error looking for our previous comment: {e}")
+    return None
+
+def read_previous_state(comment, own_login):
+    # returns the state stored in our previous comment, if any; anyone can comment on the PR, so the state is only
+    # trusted from comments posted by our own identity, and signed by STATE_SECRET when it's set
+    match = STATE_MARKER_PATTERN.search(comment.body or "") if comment is not None else None
+    if not match:
+        return None
+    if not is_own_comment(comment, own_login):
+        print(f"Ignoring the state of a comment not posted by {own_login}")
+        return None
+    try:
+        state = json.loads(match.group(1))
+    except Exception as e:
+        print(f"Error reading previous state: {e}")
+        return None
+    if not isinstance(state, dict):
+        print("Ignoring the previous state, it isn't a JSON object")
+        return None
+    signature = state.pop("signature", None)
+    expected = sign_state(state)
+    if expected and not (isinstance(signature, str) and hmac.compare_digest(signature, expected)):
+        print("Ignoring the previous state, its signature doesn't match")
+        return None
+    return state
+
+def get_changed_files(repo, previous_sha, head_sha):
+    # files touched by the commits pushed since previous_sha, or None if we can't tell (ie. after a force-push)
+    if previous_sha == head_sha:
+        return set()
+    try:
+        comparison = github_call(repo.compare, previous_sha, head_sha)
+        if comparison.status != "ahead":
+            return None
+        changed_files = set()
+        for file in comparison.files:
+            changed_files.add(file.filename)
+            if file.previous_filename:
+                changed_files.add(file.previous_filename)
+        # the compare API lists up to 300 files, so a bigger delta may be incomplete
+        if len(changed_files) >= 300:
+            return None
+        return changed_files
+    except Exception as e:
+        print(f"Error getting changes since {previous_sha}: {e}")
+        return None
+
+def get_carried_verdicts(repo, previous_state, pr_schema, checklist_items, rule_schemas, head_sha):
+    # returns {rule text: RulesOutput} from the previous run, for rules whose files and PR text didn't change since
+    if not previous_state or previous_state.get("model") != get_model_name():
+        return {}
+    if previous_state.get("text_hash") != hash_pr_text(pr_schema):
+        print("PR title or body changed since the last run, re-checking all rules")
+        return {}
+    previous_sha = previous_state.get("head_sha")
+    previous_rules = previous_state.get("rules")
+    if not isinstance(previous_sha, str) or not isinstance(previous_rules, dict):
+        print("The previous state is malformed, re-checking all rules")
+        return {}
+    changed_files = get_changed_files(repo, previous_sha, head_sha)
+    if changed_files is None:
+        print("Couldn't determine the changes since the last run, re-checking all rules")
+        return {}
+    carried_verdicts = {}
+    for rule in checklist_items:
+        previous = previous_rules.get(hash_text(rule.text))
+        if not previous:
+            continue
+        # the rule must see the same files as before, and none of them changed since
+        rule_files = get_rule_files(rule_schemas[rule.text])
+        if not isinstance(previous, dict) or previous.get("files_hash") != hash_files(rule_files) or set(rule_files) & changed_files:
+            continue
+        try:
+            carried_verdicts[rule.text] = RulesOutput.model_validate(previous.get("verdict"))
+        except ValueError as e:
+            print(f"The previous state has a malformed verdict, re-checking all rules: {e}")
+            return {}
+    print(f"Carrying forward {len(carried_verdicts)} verdicts from {previous_sha[:7]}, {len(changed_files)} files changed since")
+    return carried_verdicts
 
 def escape_text(text):
     # Enclose spaces and underscores in braces
@@ -73,6 +365,376 @@ def animated_rule(type="success",rule="",score=100,speed=3000):
         return f"[![{rule}](https://readme-typing-svg.demolab.com?font=Fira+Code&size=12&duration={speed}&pause=1500&color=FF5F15&repeat=true&random=false&width=550&height=18&lines=-+%E2%9D%8C+{escaped_text}+(score+{score}%2F100))](https://github.com/puntorigen/pr-rules)"
     return f"[![{rule}](https://readme-typing-svg.demolab.com?font=Fira+Code&size=12&duration={speed}&pause=1500&color=FF0000&repeat=true&random=false&width=550&height=18&lines=-+%E2%9D%8C+{escaped_text}+(score+{score}%2F100))](https://github.com/puntorigen/pr-rules)"
 
+def render_rule(rule, llm_response, position):
+    # markdown for the verdict of a rule, position (in the comment) staggers the animations
+    speed = 3000+(position*500)
+    if llm_response.complies:
+        #return f"- ✅ {color_text(rule, 'ForestGreen')} (score: {llm_response.score}/100)\n"
+        return animated_rule("success",rule.text,llm_response.score,speed)
+    #content = f"- ❌ {color_text(rule, 'Red')} (score: {llm_response.score}/100)\n"
+    if rule.type == 'mandatory':
+        content = animated_rule("failure",rule.text,llm_response.score,speed)
+        content += "\n- **Reason for failure:**\n"
+    else:
+        content = animated_rule("warning",rule.text,llm_response.score,speed)
+        content += "\n- **Reason for warning:**\n"
+    for reasoning in llm_response.affected_sections or []:
+        if reasoning.file:
+            content += f"  - **Affected File:** {reasoning.file}\n"
+        else:
+            content += f"  - **Affected Section:** {reasoning.section}\n"
+        content += f"  - **Reason:** {reasoning.why_is_not_complying}\n"
+        if reasoning.what_should_be_changed:
+            content += "  - **Suggested Changes:**\n"
+            for change in reasoning.what_should_be_changed:
+                content += f"    - {change}\n"
+        #if reasoning.example_fix:
+        #    content += f"  - **Example Code Improvements:**\n"
+        #    for fix in reasoning.example_fix:
+        #        content += f"    - {fix}\n"
+    return content
+
+def render_comment(header, checklist_items, rendered_rules, state=None):
+    # the verdicts received so far (in file order), followed by the rules still pending
+    comment_content = header + "".join(rendered_rules)
+    comment_content += "\n"
+    for rule in checklist_items[len(rendered_rules):]:
+        comment_content += animated_rule("pending",rule.text,100,3000) + "\n"
+        #comment_content += f"- [ ] {rule}\n"
+    marker = "\n" + COMMENT_MARKER + "\n"
+    if len(comment_content) + len(marker) > MAX_COMMENT_LENGTH:
+        note = "\n\n*The comment was truncated to fit GitHub's size limit, see the action log for every verdict.*\n"
+        comment_content = comment_content[:MAX_COMMENT_LENGTH - len(marker) - len(note)] + note
+    comment_content += marker
+    if state:
+        # the rules left out of the state are re-checked by the next run
+        state_marker = fit_state_marker(state, MAX_COMMENT_LENGTH - len(comment_content) - 1)
+        if state_marker:
+            comment_content += state_marker + "\n"
+    return comment_content
+
+def is_blocking_failure(rule, llm_response):
+    # a failing mandatory rule stops the evaluation of the rules after it
+    return rule.type == 'mandatory' and not llm_response.complies
+
+def compact_rule_schemas(rule_schemas, compacted_diff):
+    # the rules' routed schemas with the compacted diffs of their files, for the prompts
+    patches = dict(compacted_diff)
+    return {
+        rule: PRSchema(title=schema.title, body=schema.body, files_diff=[(filename, patches.get(filename, patch)) for filename, patch in schema.files_diff])
+        if schema is not None else None
+        for rule, schema in rule_schemas.items()
+    }
+
+def get_local_verdicts(rule_schemas, checklist_items, known_verdicts):
+    # decides the mechanically checkable rules locally, without calling the LLM
+    local_verdicts = {}
+    for rule in checklist_items:
+        if rule.text in known_verdicts or rule_schemas[rule.text] is None:
+            continue
+        local_response = run_local_checkers(rule_schemas[rule.text], rule.text)
+        if local_response is not None:
+            local_verdicts[rule.text] = local_response
+    return local_verdicts
+
+def needs_crew(pr_schema, rule, cache=None, known_verdicts=None):
+    # whether check_rule will have to run the crew to validate the rule
+    if (known_verdicts and rule.text in known_verdicts) or pr_schema is None:
+        return False
+    return cache is None or not cache.has(cache.key(pr_schema, rule.text, get_model_name()))
+
+def check_rule(pr_schema, rule, cache=None, cancel_event=None, known_verdicts=None, session=None, relevance=None):
+    # returns the cached verdict for the rule if the PR contents it sees didn't change, otherwise runs the crew;
+    # pr_schema only holds the files routed to the rule, or is None when no changed file is in its scope;
+    # known_verdicts holds the verdicts decided before evaluating (carried from the last run or by local checkers)
+    # and relevance the rules' relevance from the batched triage
+    if known_verdicts and rule.text in known_verdicts:
+        return known_verdicts[rule.text]
+    if pr_schema is None:
+        print(f"No changed files in scope, rule passes: {rule.text}")
+        return RulesOutput(complies=True, affected_sections=None, score=100)
+    is_relevant = (relevance or {}).get(rule.text)
+    if cache is None:
+        return validate_rule(pr_schema, rule.text, cancel_event, session, is_relevant)
+    cache_key = cache.key(pr_schema, rule.text, get_model_name())
+    llm_response = cache.get(cache_key)
+    if llm_response is not None:
+        print(f"Using cached verdict for rule: {rule.text}")
+        return llm_response
+    llm_response = validate_rule(pr_schema, rule.text, cancel_event, session, is_relevant)
+    if llm_response is not None:
+        cache.set(cache_key, llm_response)
+    return llm_response
+
+def estimate_rule_tokens(pr_schema):
+    # estimated tokens of the PR context sent to the crew for a rule
+    return estimate_tokens(f"{pr_schema.title}\n{pr_schema.body}") + sum(estimate_file_tokens(file) for file in pr_schema.files_diff)
+
+def evaluate_rules(rule_schemas, checklist_items, max_workers=1, cache=None, known_verdicts=None, session=None, relevance=None, stats=None, order=None):
+    # yields (rule, llm_response) in file order, stopping after the first failing mandatory rule;
+    # rules are validated following order (indexes of checklist_items, file order by default), and once a mandatory rule
+    # fails the ones after it are skipped, so the results are the same as checking them one by one in file order
+    order = order or list(range(len(checklist_items)))
+    cancel_events = [threading.Event() for _ in checklist_items]
+    results = {}
+    cutoff = len(checklist_items) # index of the first failing mandatory rule found so far
+    next_index = 0 # next rule to yield in file order
+
+    def check(index):
+        rule = checklist_items[index]
+        pr_schema = rule_schemas[rule.text]
+        uses_crew = needs_crew(pr_schema, rule, cache, known_verdicts)
+        start = time.perf_counter()
+        # the service keeps one Metrics across PRs, so only the tokens used by this validation are counted
+        tokens_before = session.metrics.rule_tokens(rule.text) if session else 0
+        with session.metrics.stage("rule", rule.text) if session and uses_crew else nullcontext():
+            llm_response = check_rule(pr_schema, rule, cache=cache, cancel_event=cancel_events[index], known_verdicts=known_verdicts, session=session, relevance=relevance)
+        if stats is not None and uses_crew and llm_response is not None:
+            # measured tokens when the LLM reported its usage, estimated otherwise
+            tokens = ((session.metrics.rule_tokens(rule.text) - tokens_before) if session else 0) or estimate_rule_tokens(pr_schema)
+            stats.record(rule.text, llm_response.complies, time.perf_counter() - start, tokens)
+        return llm_response
+
+    if max_workers <= 1:
+        for index in order:
+            if index > cutoff:
+                continue
+            results[index] = check(index)
+            if is_blocking_failure(checklist_items[index], results[index]):
+                cutoff = index
+                print(f"Mandatory rule failed, skipping the rules after it: {checklist_items[index].text}")
+            while next_index in results and next_index <= cutoff:
+                yield checklist_items[next_index], results[next_index]
+                next_index += 1
+        return
+
+    # speculatively validate the next rules while we wait for the current one;
+    # once a mandatory rule fails, queued rules after it are cancelled and in-flight ones are told to stop
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(check, index): index for index in order}
+    try:
+        for future in as_completed(futures):
+            index = futures[future]
+            if index > cutoff or future.cancelled():
+                continue
+            results[index] = future.result()
+            if is_blocking_failure(checklist_items[index], results[index]):
+                cutoff = index
+                print(f"Mandatory rule failed, cancelling the rules after it: {checklist_items[index].text}")
+                for other_future, other_index in futures.items():
+                    if other_index > cutoff:
+                        other_future.cancel()
+                        cancel_events[other_index].set()
+            while next_index in results and next_index <= cutoff:
+                yield checklist_items[next_index], results[next_index]
+                next_index += 1
+            if next_index > cutoff:
+                return
+    finally:
+        for cancel_event in cancel_events:
+            cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def start_local_model(metrics):
+    # loads the first model of the cascade while the PR is fetched, the first crew waits for it if needed
+    model = get_model_tiers()[0] or OLLAMA_MODEL
+    try:
+        with metrics.stage("model_startup"):
+            get_ollama_manager(os.getenv('OPENAI_API_BASE')).ensure_model(model)
+    except Exception as e:
+        print(f"Error preparing the Ollama model, retrying on first use: {e}")
+
+@dataclass
+class Settings:
+    rules_file_path: str
+    openai_api_key: Optional[str] = None
+    reuse_session: bool = True
+    batch_triage: bool = True
+    batch_compliance: bool = False
+    batch_min_confidence: int = 70
+    max_workers: int = 1
+    cache_dir: Optional[str] = None
+    stats_file: Optional[str] = None
+    checkers_file: Optional[str] = None
+    diff_source: str = 'auto'
+    compact_diff: bool = True
+    diff_context_lines: int = 1
+    max_file_tokens: int = 8000
+    comment_update_interval: float = 5
+    metrics_file: Optional[str] = None
+
+def get_settings(rules_file_path, openai_api_key=None):
+    cache_dir = os.getenv('CACHE_DIR')
+    return Settings(
+        rules_file_path=rules_file_path,
+        openai_api_key=openai_api_key,
+        # set REUSE_SESSION=false to rebuild LLM clients and agents for every rule (to measure the setup overhead)
+        reuse_session=(os.getenv('REUSE_SESSION') or 'true').lower() != 'false',
+        # ask for the relevance of all the rules in one LLM call, instead of one call per rule
+        batch_triage=(os.getenv('BATCH_TRIAGE') or 'true').lower() != 'false',
+        # check groups of rules sharing the same files in a single LLM call, falling back to one crew per rule
+        batch_compliance=(os.getenv('BATCH_COMPLIANCE') or 'false').lower() == 'true',
+        batch_min_confidence=int(os.getenv('BATCH_MIN_CONFIDENCE') or 70),
+        # number of rules validated concurrently (1 = one rule at a time)
+        max_workers=int(os.getenv('MAX_WORKERS') or 1),
+        # directory for cached rule verdicts (disabled when empty)
+        cache_dir=cache_dir,
+        # per-rule pass rate and cost, used to validate first the mandatory rules most likely to fail quickly
+        stats_file=os.getenv('STATS_FILE') or (os.path.join(cache_dir, 'rule-stats.json') if cache_dir else None),
+        # optional python file registering custom local checkers
+        checkers_file=os.getenv('CHECKERS_FILE'),
+        # where to read the diffs and rules file from: 'auto' (local checkout, falling back to the API) or 'api'
+        diff_source=(os.getenv('DIFF_SOURCE') or 'auto').lower(),
+        # strip noise from the diffs (context lines, whitespace-only hunks, generated files) before building prompts
+        compact_diff=(os.getenv('COMPACT_DIFF') or 'true').lower() != 'false',
+        diff_context_lines=int(os.getenv('DIFF_CONTEXT_LINES') or 1),
+        max_file_tokens=int(os.getenv('MAX_FILE_TOKENS') or 8000),
+        # minimum seconds between edits of the PR comment while the rules are evaluated
+        comment_update_interval=float(os.getenv('COMMENT_UPDATE_INTERVAL') or 5),
+        # JSON report of the timings per stage, and of the tokens and cost per rule and agent (disabled when empty)
+        metrics_file=os.getenv('METRICS_FILE')
+    )
+
+def configure_llm(openai_api_key, metrics):
+    # set OpenAI api key or install & use Ollama
+    if openai_api_key:
+        os.environ["LLM_TYPE"] = "openai"
+        os.environ["OPENAI_API_KEY"] = openai_api_key
+        os.environ["OPENAI_MODEL_NAME"] = "gpt-4" # the best model for these tasks
+        return None
+    os.environ["LLM_TYPE"] = "ollama"
+    os.environ["OPENAI_API_BASE"] = "http://127.0.0.1:11434" # Ollama API base URL; use docker instance name inside actions
+    os.environ["OPENAI_API_KEY"] = "ollama"
+    #os.environ["OPENAI_MODEL_NAME"] = "phi3:3.8b-mini-128k-instruct-q8_0"
+    model_thread = threading.Thread(target=start_local_model, args=(metrics,), daemon=True)
+    model_thread.start()
+    return model_thread
+
+def check_pull_request(github, repository, pull_number, settings: Settings, session: CrewSession, cache=None, stats=None):
+    # evaluates the rules of the given PR, keeping its comment up to date; returns the checklist items left
+    # unchecked after a failing mandatory rule, or None when the rules file can't be read.
+    # session, cache and stats can be shared by several PRs, ie. by pr_rules_server.py
+    metrics = session.metrics
+    with metrics.stage("github_fetch"):
+        # retries are left to the shared scheduler (see github_call)
+        repo = github_call(github.get_repo, repository)
+
+        # Get the pull request details
+        pr = github_call(repo.get_pull, int(pull_number))
+        base_branch = pr.base.ref
+        compare_branch = pr.head.ref
+
+        # Read rules from markdown file, from the local checkout when available
+        local_repo = open_local_repo() if settings.diff_source != 'api' else None
+        rules_content = None
+        if local_repo:
+            rules_content = read_local_markdown_file(local_repo, pr.base.sha, settings.rules_file_path)
+        if rules_content is None:
+            rules_content = read_markdown_file(repo, base_branch, settings.rules_file_path)
+    if rules_content is None:
+        print("Failed to read the rules file. Exiting.")
+        return None
+
+    checklist_items = parse_checklist_items(rules_content)
+
+    # Show the pending checklist right away, in the comment of our previous run when there is one
+    comment_header = "# PR Rules Checklist\n"
+    if not settings.openai_api_key:
+        comment_header += "(ollama version)\n\n"
+    comment_header += "\n"
+    with metrics.stage("github_fetch"):
+        own_login = get_own_login(github)
+        own_comment = find_own_comment(pr, own_login)
+        previous_state = read_previous_state(own_comment, own_login)
+    comment_updater = CommentUpdater(pr, own_comment, settings.comment_update_interval, metrics)
+    # the previous state is kept until this run's verdicts replace it, in case the run doesn't finish
+    comment_updater.update(render_comment(comment_header, checklist_items, [], previous_state), force=True)
+
+    # Get the diff of the modified files between the base branch and the compare branch
+    print(f"Getting diff between {base_branch} and {compare_branch}...")
+    diff = None
+    prompt_diff = None
+    with metrics.stage("diff"):
+        if local_repo:
+            diff = get_local_diff(local_repo, pr.base.sha, pr.head.sha, pr.commits + 1)
+        if diff is None:
+            diff = get_diff(repo, base_branch, compare_branch)
+        # only the prompts get the compacted diff, routing and the local checkers need every changed line
+        if diff and settings.compact_diff:
+            prompt_diff, compaction_stats = compact_files_diff(diff, settings.diff_context_lines, settings.max_file_tokens)
+    if prompt_diff:
+        print(f"Diff compaction saved {compaction_stats['saved_bytes']} of {compaction_stats['original_bytes']} bytes (~{compaction_stats['saved_tokens']} tokens) over {compaction_stats['files']} files")
+
+    pr_schema = PRSchema(
+        title = pr.title,
+        body = pr.body,
+        files_diff = diff or []
+    )
+    print(f"Checking {len(checklist_items)} rules using {settings.max_workers} worker(s)")
+
+    # Route each rule to the changed files in its scope
+    rule_schemas = route_rules(pr_schema, checklist_items)
+
+    # Reuse the previous run's verdicts for rules not touched by the commits pushed since then
+    head_sha = pr.head.sha
+    with metrics.stage("github_fetch"):
+        carried_verdicts = get_carried_verdicts(repo, previous_state, pr_schema, checklist_items, rule_schemas, head_sha)
+    known_verdicts = dict(carried_verdicts)
+    known_verdicts.update(get_local_verdicts(rule_schemas, checklist_items, known_verdicts))
+
+    # What the crews see of the PR, and of each rule's files
+    if prompt_diff:
+        prompt_pr_schema = PRSchema(title = pr.title, body = pr.body, files_diff = prompt_diff)
+        prompt_schemas = compact_rule_schemas(rule_schemas, prompt_diff)
+    else:
+        prompt_pr_schema, prompt_schemas = pr_schema, rule_schemas
+
+    # Ask once which of the rules left for the crew are relevant to the PR
+    relevance = {}
+    crew_rules = [rule.text for rule in checklist_items if needs_crew(prompt_schemas[rule.text], rule, cache, known_verdicts)]
+    if settings.batch_triage and len(crew_rules) > 1:
+        relevance = triage_rules(prompt_pr_schema, crew_rules, session)
+
+    # Check the relevant rules in groups sharing the same files, when enabled
+    if settings.batch_compliance:
+        batch_schemas = {rule: prompt_schemas[rule] for rule in crew_rules if relevance.get(rule) != False}
+        for group_schema, group in group_rules(batch_schemas):
+            for rule_text, llm_response in validate_rules_batch(group_schema, group, session, settings.batch_min_confidence).items():
+                known_verdicts[rule_text] = llm_response
+                if cache:
+                    cache.set(cache.key(group_schema, rule_text, get_model_name()), llm_response)
+    # Validate first the cheap mandatory rules that usually fail, the comment still lists rules in file order
+    free_rules = [rule.text for rule in checklist_items if not needs_crew(prompt_schemas[rule.text], rule, cache, known_verdicts)]
+    order = stats.order(checklist_items, free_rules) if stats else None
+    if order:
+        print("Evaluation order: " + ", ".join(str(index+1) for index in order))
+
+    state = {
+        "head_sha": head_sha,
+        "model": get_model_name(),
+        "text_hash": hash_pr_text(pr_schema),
+        "rules": {}
+    }
+
+    rendered_rules = []
+    for rule, llm_response in evaluate_rules(prompt_schemas, checklist_items, settings.max_workers, cache, known_verdicts, session, relevance, stats, order):
+        print(f"------------------------------")
+        print(f"LLM Crew Response received for rule: {rule.text}", llm_response)
+        state["rules"][hash_text(rule.text)] = {
+            "files_hash": hash_files(get_rule_files(rule_schemas[rule.text])),
+            "verdict": llm_response.model_dump(mode="json")
+        }
+        rendered_rules.append(render_rule(rule, llm_response, len(rendered_rules)))
+        comment_updater.update(render_comment(comment_header, checklist_items, rendered_rules, state))
+        # Stop processing further rules on failure, only if rule.type is mandatory
+        if is_blocking_failure(rule, llm_response):
+            break
+
+    # Post the final comment, with the remaining unchecked items
+    comment_updater.update(render_comment(comment_header, checklist_items, rendered_rules, state), force=True)
+    print(f"PR comment written {comment_updater.writes} times")
+    return checklist_items[len(rendered_rules):]
+
 def main():
     # test inputs source
     rules_file_path = os.getenv('FILE_PATH')
@@ -86,102 +748,45 @@ def main():
         token = os.getenv('GITHUB_TOKEN')
         openai_api_key = os.getenv('OPENAI_API_KEY')
 
-    # set OpenAI api key or install & use Ollama
-    if openai_api_key:
-        os.environ["LLM_TYPE"] = "openai"
-        os.environ["OPENAI_API_KEY"] = openai_api_key
-        os.environ["OPENAI_MODEL_NAME"] = "gpt-4" # the best model for these tasks
-    else:
-        os.environ["LLM_TYPE"] = "ollama"
-        os.environ["OPENAI_API_BASE"] = "http://127.0.0.1:11434" # Ollama API base URL; use docker instance name inside actions
-        os.environ["OPENAI_API_KEY"] = "ollama"
-        #os.environ["OPENAI_MODEL_NAME"] = "phi3:3.8b-mini-128k-instruct-q8_0"
+    settings = get_settings(rules_file_path, openai_api_key)
+    metrics = Metrics()
+    configure_llm(openai_api_key, metrics)
 
     # GitHub repository details from environment variables
     repository = os.getenv('GITHUB_REPOSITORY')
     ref = os.getenv('GITHUB_REF')
     pull_number = ref.split('/')[-2]
-    owner, repo_name = repository.split('/')
-
-    # Initialize GitHub API
-    g = Github(token)
-    repo = g.get_repo(f"{owner}/{repo_name}")
 
-    # Get the pull request details
-    pr = repo.get_pull(int(pull_number))
-    base_branch = pr.base.ref
-    compare_branch = pr.head.ref
+    if settings.checkers_file:
+        print(f"Loading custom checkers from {settings.checkers_file}")
+        load_checkers_file(settings.checkers_file)
 
-    # Read rules from markdown file
-    rules_content = read_markdown_file(repo, base_branch, rules_file_path)
-    if rules_content is None:
-        print("Failed to read the rules file. Exiting.")
+    cache = VerdictCache(settings.cache_dir) if settings.cache_dir else None
+    stats = RuleStats(settings.stats_file) if settings.stats_file else None
+    session = CrewSession(reuse=settings.reuse_session, metrics=metrics)
+    # Initialize GitHub API, retries are left to the shared scheduler (see github_call)
+    remaining_items = check_pull_request(Github(token, retry=None), repository, pull_number, settings, session, cache, stats)
+    if remaining_items is None:
+        session.close()
         return
 
-    checklist_items = parse_checklist_items(rules_content)
-
-    # Get the diff of the modified files between the base branch and the compare branch
-    print(f"Getting diff between {base_branch} and {compare_branch}...")
-    diff = get_diff(repo, base_branch, compare_branch)
-
-    # Build comment content
-    comment_content = "# PR Rules Checklist\n"
-    if not openai_api_key:
-        comment_content += "(ollama version)\n\n"
-    comment_content += "\n"
-
-    processed_items_count = 0
-    for rule in checklist_items:
-        print(f"------------------------------")
-        print(f"Checking rule: {rule.text}")
-
-        llm_response = validate_rule(PRSchema(
-            title = pr.title,
-            body = pr.body,
-            files_diff = diff
-        ), rule.text)
+    print(f"Crew session setup: {session.summary()}")
+    print(f"LLM requests: {get_scheduler('llm').summary()}")
+    print(f"GitHub requests: {get_scheduler('github').summary()}")
+    print(f"Rules settled by the crew: {session.tiers_summary()}")
+    session.close()
 
-        print(f"LLM Crew Response received for rule: {rule.text}", llm_response)
+    if stats:
+        stats.save()
 
-        if llm_response.complies:
-            #comment_content += f"- ✅ {color_text(rule, 'ForestGreen')} (score: {llm_response.score}/100)\n"
-            comment_content += animated_rule("success",rule.text,llm_response.score,3000+(processed_items_count*500))
-        else:
-            #comment_content += f"- ❌ {color_text(rule, 'Red')} (score: {llm_response.score}/100)\n"
-            if rule.type == 'mandatory':
-                comment_content += animated_rule("failure",rule.text,llm_response.score,3000+(processed_items_count*500))
-                comment_content += "\n- **Reason for failure:**\n"
-            else:
-                comment_content += animated_rule("warning",rule.text,llm_response.score,3000+(processed_items_count*500))
-                comment_content += "\n- **Reason for warning:**\n"
-            for reasoning in llm_response.affected_sections or []:
-                if reasoning.file:
-                    comment_content += f"  - **Affected File:** {reasoning.file}\n"
-                else:
-                    comment_content += f"  - **Affected Section:** {reasoning.section}\n"
-                comment_content += f"  - **Reason:** {reasoning.why_is_not_complying}\n"
-                if reasoning.what_should_be_changed:
-                    comment_content += "  - **Suggested Changes:**\n"
-                    for change in reasoning.what_should_be_changed:
-                        comment_content += f"    - {change}\n"
-                #if reasoning.example_fix:
-                #    comment_content += f"  - **Example Code Improvements:**\n"
-                #    for fix in reasoning.example_fix:
-                #        comment_content += f"    - {fix}\n"
-            # Stop processing further rules on failure, only if rule.type is mandatory
-            if rule.type == 'mandatory':
-                break  
-        processed_items_count += 1
-
-    # Add remaining unchecked items
-    remaining_items = checklist_items[processed_items_count+1:]
-    comment_content += "\n"
-    for rule in remaining_items:
-        comment_content += animated_rule("pending",rule.text,100,3000) + "\n"
-        #comment_content += f"- [ ] {rule}\n" 
+    if cache:
+        removed = cache.prune()
+        print(f"Verdict cache: {cache.hits} hits, {cache.misses} misses, {removed} entries evicted")
 
-    # Post the comment on the PR
-    post_comment(pr, comment_content)
+    print(metrics.summary_markdown())
+    metrics.write_step_summary()
+    if settings.metrics_file:
+        metrics.write_json(settings.metrics_file)
 
     # Fail the action if we have any remaining rules to check and we are not ollama
     if remaining_items and openai_api_key:
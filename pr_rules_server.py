@@ -0,0 +1,378 @@
+# Long-running service mode: checks many PRs from one process, keeping the LLM clients, the local model, the verdict
+# cache and the rule statistics warm between them. Jobs come from POST /jobs or from GitHub's pull_request webhooks on
+# POST /webhook, wait in a bounded queue and run on a fixed pool of workers, ie. 'python pr_rules_server.py --port 8080'
+import os, sys, hmac, json, time, queue, signal, hashlib, argparse, ipaddress, threading, itertools
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+from github import Github
+from pr_rules_check import Settings, get_settings, configure_llm, check_pull_request
+from crew.checkers import load_checkers_file
+from crew.cache import VerdictCache
+from crew.rule_stats import RuleStats
+from crew.session import CrewSession
+from crew.metrics import Metrics
+from crew.scheduler import get_scheduler
+
+# pull_request webhook actions that change what the rules see
+WEBHOOK_ACTIONS = ("opened", "reopened", "synchronize", "edited", "ready_for_review")
+# finished jobs kept for GET /jobs
+MAX_FINISHED_JOBS = 1000
+# minimum seconds between evictions of old verdict cache entries
+CACHE_PRUNE_INTERVAL = 3600
+# rules whose timings and token usage are kept for GET /metrics
+MAX_METRICS_RULES = 1000
+# largest request body read, GitHub's pull_request payloads are well below it
+MAX_BODY_BYTES = 5 * 1024 * 1024
+
+@dataclass
+class Job:
+    id: str
+    repository: str
+    pull_number: int
+    rules_file_path: Optional[str] = None
+    token: Optional[str] = field(default=None, repr=False) # never reported
+    # queued, running, passed, failed (a mandatory rule doesn't comply), skipped (no rules file), error or cancelled
+    status: str = "queued"
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    remaining_rules: Optional[int] = None
+    error: Optional[str] = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "repository": self.repository,
+            "pull_number": self.pull_number,
+            "rules_file_path": self.rules_file_path,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "seconds": (self.finished or time.time()) - self.started if self.started else None,
+            "remaining_rules": self.remaining_rules,
+            "error": self.error
+        }
+
+class QueueFull(Exception):
+    pass
+
+class PRRulesService():
+    def __init__(self, settings: Settings, token, workers=2, queue_size=100):
+        self.settings = settings
+        self.token = token
+        self.metrics = Metrics(max_rules=MAX_METRICS_RULES)
+        configure_llm(settings.openai_api_key, self.metrics)
+        if settings.checkers_file:
+            print(f"Loading custom checkers from {settings.checkers_file}")
+            load_checkers_file(settings.checkers_file)
+        # shared by every job, so clients, connections, verdicts and statistics stay warm across PRs
+        self.session = CrewSession(reuse=settings.reuse_session, metrics=self.metrics)
+        self.cache = VerdictCache(settings.cache_dir) if settings.cache_dir else None
+        self.stats = RuleStats(settings.stats_file) if settings.stats_file else None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.jobs = OrderedDict() # id -> Job, oldest first
+        self.queued = {} # (repository, pull_number) -> job waiting in the queue
+        self.pr_locks = {} # (repository, pull_number) -> [lock held by the worker checking it, workers using it]
+        self.github_clients = {} # token -> Github
+        self.last_prune = time.monotonic()
+        self.workers = [threading.Thread(target=self.work, name=f"pr-rules-worker-{index+1}", daemon=True) for index in range(workers)]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, repository, pull_number, rules_file_path=None, token=None):
+        # queues a check of the PR, returning (job, created); while a check of the same PR is still waiting in the
+        # queue, new pushes reuse it instead, since it'll see the latest commits anyway
+        key = (repository, int(pull_number))
+        with self.lock:
+            job = self.queued.get(key)
+            if job is not None and job.rules_file_path == rules_file_path and job.token == token:
+                return job, False
+            job = Job(id=str(next(self.ids)), repository=repository, pull_number=int(pull_number), rules_file_path=rules_file_path, token=token)
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFull(f"{self.queue.maxsize} jobs already queued")
+            self.queued[key] = job
+            self.jobs[job.id] = job
+            self.trim_jobs()
+        print(f"[job {job.id}] queued {repository}#{pull_number}")
+        return job, True
+
+    def trim_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished is not None]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def get_github(self, token):
+        # retries are left to the shared scheduler (see pr_rules_check.github_call)
+        with self.lock:
+            if token not in self.github_clients:
+                self.github_clients[token] = Github(token, retry=None)
+            return self.github_clients[token]
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            key = (job.repository, job.pull_number)
+            with self.lock:
+                if self.queued.get(key) is job:
+                    del self.queued[key]
+                pr_lock = self.pr_locks.setdefault(key, [threading.Lock(), 0])
+                pr_lock[1] += 1
+            # two workers editing the same PR comment would overwrite each other's verdicts
+            try:
+                with pr_lock[0]:
+                    self.run(job)
+            finally:
+                # the lock is dropped once no worker needs it, so the service doesn't keep one per PR ever checked
+                with self.lock:
+                    pr_lock[1] -= 1
+                    if pr_lock[1] == 0:
+                        del self.pr_locks[key]
+
+    def run(self, job: Job):
+        job.status = "running"
+        job.started = time.time()
+        print(f"[job {job.id}] checking {job.repository}#{job.pull_number}")
+        settings = replace(self.settings, rules_file_path=job.rules_file_path) if job.rules_file_path else self.settings
+        try:
+            remaining_items = check_pull_request(self.get_github(job.token or self.token), job.repository, job.pull_number,
+                                                 settings, self.session, self.cache, self.stats)
+            if remaining_items is None:
+                job.status = "skipped"
+            else:
+                job.remaining_rules = len(remaining_items)
+                job.status = "failed" if remaining_items else "passed"
+        except Exception as e:
+            job.status = "error"
+            job.error = f"{e.__class__.__name__}: {e}"
+            print(f"[job {job.id}] error checking {job.repository}#{job.pull_number}: {job.error}")
+        finally:
+            job.finished = time.time()
+        print(f"[job {job.id}] {job.status} in {job.finished - job.started:.1f}s")
+        self.save()
+
+    def save(self, prune=False):
+        if self.stats:
+            self.stats.save()
+        if self.cache and (prune or time.monotonic() - self.last_prune > CACHE_PRUNE_INTERVAL):
+            self.last_prune = time.monotonic()
+            removed = self.cache.prune()
+            print(f"Verdict cache: {self.cache.hits} hits, {self.cache.misses} misses, {removed} entries evicted")
+
+    def status(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return {
+            "queued": sum(1 for job in jobs if job.status == "queued"),
+            "running": sum(1 for job in jobs if job.status == "running"),
+            "finished": sum(1 for job in jobs if job.finished is not None),
+            "workers": len(self.workers),
+            "queue_size": self.queue.maxsize,
+            "session": self.session.summary(),
+            "llm_requests": get_scheduler('llm').summary(),
+            "github_requests": get_scheduler('github').summary()
+        }
+
+    def list_jobs(self):
+        with self.lock:
+            return [job.to_dict() for job in reversed(self.jobs.values())]
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def stop(self):
+        # cancels the queued jobs and lets the running ones finish, then saves the statistics and closes the session
+        while True:
+            try:
+                job = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            job.status = "cancelled"
+            job.finished = time.time()
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.save(prune=True)
+        self.session.close()
+        print(self.metrics.summary_markdown())
+        if self.settings.metrics_file:
+            self.metrics.write_json(self.settings.metrics_file)
+
+def verify_signature(secret, body, signature):
+    # X-Hub-Signature-256 of GitHub webhooks
+    expected = "sha256=" + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+def make_handler(service: PRRulesService, webhook_secret=None, api_key=None, public=False):
+    # on a public host, the endpoints whose secret isn't set are refused instead of left open
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, payload, status=200):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def read_body(self):
+            # returns None, after answering the request, when the body is missing a valid size or is too large
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0 or length > MAX_BODY_BYTES:
+                self.close_connection = True # the unread body can't be skipped
+                self.send_json({"error": f"expected a body of at most {MAX_BODY_BYTES} bytes"}, 413 if length > 0 else 400)
+                return None
+            return self.rfile.read(length)
+
+        def refuse(self, error, status):
+            # answers without reading the body, so the connection can't be reused
+            self.close_connection = True
+            self.send_json({"error": error}, status)
+
+        def authorized(self):
+            # whether the request may use the API endpoints, answering it when it may not
+            if api_key:
+                if hmac.compare_digest(self.headers.get("Authorization") or "", f"Bearer {api_key}"):
+                    return True
+                self.refuse("unauthorized", 401)
+                return False
+            if public:
+                self.refuse("SERVER_API_KEY is required on a public host", 403)
+                return False
+            return True
+
+        def queue_job(self, repository, pull_number, rules_file_path=None, token=None):
+            try:
+                job, created = service.submit(repository, pull_number, rules_file_path, token)
+            except QueueFull as e:
+                return self.send_json({"error": str(e)}, 503)
+            self.send_json({**job.to_dict(), "created_job": created}, 202)
+
+        def do_GET(self):
+            path = self.path.split('?')[0].rstrip('/')
+            if path in ("", "/health"):
+                return self.send_json({"status": "ok", **service.status()})
+            # jobs and metrics show repository names and rule texts
+            if path in ("/metrics", "/jobs") or path.startswith("/jobs/"):
+                if not self.authorized():
+                    return
+            if path == "/metrics":
+                return self.send_json(service.metrics.report())
+            if path == "/jobs":
+                return self.send_json({"jobs": service.list_jobs()})
+            if path.startswith("/jobs/"):
+                job = service.get_job(path[len("/jobs/"):])
+                return self.send_json(job) if job else self.send_json({"error": "job not found"}, 404)
+            self.send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            path = self.path.split('?')[0].rstrip('/')
+            if path == "/jobs":
+                if not self.authorized():
+                    return
+                body = self.read_body()
+                if body is None:
+                    return
+                try:
+                    request = json.loads(body or b"{}")
+                    repository, pull_number = request["repository"], int(request["pull_number"])
+                except (ValueError, KeyError, TypeError):
+                    return self.send_json({"error": "expected {\"repository\": \"owner/repo\", \"pull_number\": 1}"}, 400)
+                return self.queue_job(repository, pull_number, request.get("rules_file_path"), request.get("token"))
+            if path == "/webhook":
+                # the signature covers the body, so it can only be checked once the body is read
+                if not webhook_secret and public:
+                    return self.refuse("WEBHOOK_SECRET is required on a public host", 403)
+                if webhook_secret and not self.headers.get("X-Hub-Signature-256"):
+                    return self.refuse("invalid signature", 401)
+                body = self.read_body()
+                if body is None:
+                    return
+                if webhook_secret and not verify_signature(webhook_secret, body, self.headers.get("X-Hub-Signature-256")):
+                    return self.send_json({"error": "invalid signature"}, 401)
+                event = self.headers.get("X-GitHub-Event")
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError:
+                    return self.send_json({"error": "invalid JSON"}, 400)
+                if event == "ping":
+                    return self.send_json({"status": "pong"})
+                if event != "pull_request" or payload.get("action") not in WEBHOOK_ACTIONS:
+                    return self.send_json({"status": "ignored"})
+                pull = payload.get("pull_request") or {}
+                if pull.get("state") == "closed":
+                    return self.send_json({"status": "ignored"})
+                repository = (payload.get("repository") or {}).get("full_name")
+                pull_number = pull.get("number") or payload.get("number")
+                if not repository or not pull_number:
+                    return self.send_json({"error": "missing repository or pull request number"}, 400)
+                return self.queue_job(repository, pull_number)
+            self.refuse("not found", 404)
+
+    return Handler
+
+def is_loopback_host(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service checking PRs against their rules file, fed by a job queue")
+    parser.add_argument("--host", default=os.getenv('SERVER_HOST') or "127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv('SERVER_PORT') or 8080))
+    parser.add_argument("--workers", type=int, default=int(os.getenv('SERVER_WORKERS') or 2), help="PRs checked concurrently")
+    parser.add_argument("--queue-size", type=int, default=int(os.getenv('SERVER_QUEUE_SIZE') or 100), help="jobs waiting before new ones are refused")
+    args = parser.parse_args()
+
+    token = os.getenv('GITHUB_TOKEN')
+    if not token:
+        print("GITHUB_TOKEN is required")
+        sys.exit(1)
+    webhook_secret = os.getenv('WEBHOOK_SECRET')
+    api_key = os.getenv('SERVER_API_KEY')
+    # on a public host, POST /webhook needs WEBHOOK_SECRET and the API endpoints SERVER_API_KEY, so without either
+    # anyone reaching the port could queue checks billed to our token and LLM keys
+    public = not is_loopback_host(args.host)
+    if public and not webhook_secret and not api_key:
+        print(f"Refusing to listen on {args.host} without WEBHOOK_SECRET or SERVER_API_KEY")
+        sys.exit(1)
+    # the service has no checkout of the PRs' repositories, so it reads them through the API unless told otherwise
+    settings = get_settings(os.getenv('FILE_PATH') or "pr-rules.md", os.getenv('OPENAI_API_KEY'))
+    settings.diff_source = (os.getenv('DIFF_SOURCE') or 'api').lower()
+    service = PRRulesService(settings, token, args.workers, args.queue_size)
+    service.start()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service, webhook_secret, api_key, public))
+    # docker stop sends SIGTERM
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"listening on http://{args.host}:{server.server_address[1]} with {args.workers} worker(s)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("Stopping, waiting for the running jobs...")
+        service.stop()